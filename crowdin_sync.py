@@ -24,22 +24,96 @@
 # ################################# IMPORTS ################################## #
 
 import argparse
+import atexit
+import collections
+import contextlib
+import cProfile
+import hashlib
+import io
 import json
 import git
+import multiprocessing
 import os
+import pstats
 import re
+import resource
+import shlex
 import shutil
 import subprocess
 import sys
+import tempfile
+import threading
+import time
+import tracemalloc
 import yaml
+import zipfile
 
+from concurrent.futures import (FIRST_COMPLETED, Future, ProcessPoolExecutor,
+                                ThreadPoolExecutor, as_completed, wait)
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from lxml import etree
-from signal import signal, SIGINT
+from signal import signal, SIGINT, SIGTERM
+
+# Only needed for the Crowdin API backend
+try:
+    import requests
+except ImportError:
+    requests = None
 
 # ################################# GLOBALS ################################## #
 
 _DIR = os.path.dirname(os.path.realpath(__file__))
 _COMMITS_CREATED = False
+# Names of the branches whose download failed in this run
+_BRANCHES_FAILED = []
+# Opened git repositories by path, see open_repo()
+_REPOS = {}
+# Permissions of new files are taken from the umask, which can only be read by
+# setting it, so it is read once before any threads are started
+_UMASK = os.umask(0o022)
+os.umask(_UMASK)
+
+# The ssh command can be replaced, e.g. by tools/fake_gerrit_ssh.py for testing
+_GERRIT_SSH = shlex.split(os.getenv('AICP_GERRIT_SSH', 'ssh'))
+_GERRIT_HOST = 'gerrit.aicp-rom.com'
+_GERRIT_PORT = '29418'
+# Pushes can be redirected, e.g. to local bare repositories for benchmarks
+_GERRIT_PUSH_URL = os.getenv('AICP_GERRIT_PUSH_URL')
+# ssh exits with 255 if the connection itself failed, which is worth a retry
+_GERRIT_RETRIES = 3
+# Seconds the shared ssh connection stays open without any calls
+_GERRIT_PERSIST = 60
+
+# The API URL can be replaced, e.g. by tools/fake_crowdin_api.py for testing
+_CROWDIN_API_URL = os.getenv('AICP_CROWDIN_API_URL', 'https://api.crowdin.com/api/v2')
+_CROWDIN_API_TOKEN_ENV = 'AICP_CROWDIN_API_TOKEN'
+# Seconds between polling the status of a translation build
+_CROWDIN_BUILD_POLL = 2
+
+# Results of clean_xml_file
+_CLEAN_SKIPPED = 'skipped'
+_CLEAN_CLEANED = 'cleaned'
+_CLEAN_REMOVED = 'removed'
+_CLEAN_RESET = 'reset'
+_CLEAN_FAILED = 'failed'
+
+# Bump whenever the cleaning changes, so cached results are discarded
+_CACHE_VERSION = 1
+
+# Timings and counts of this run, written at exit with --metrics
+_METRICS = {'start': time.time(), 'phases': {}, 'counts': {}, 'repos': {}, 'bases': {}}
+_METRICS_LOCK = threading.Lock()
+
+# Directory of the profiles written with --profile, profiling is off if None
+_PROFILE_DIR = None
+_PROFILES = {}
+# Number of allocation sites listed in the memory reports
+_PROFILE_TOP = 25
+# Maximum number of files handed to a cleaning process at once
+_CLEAN_BATCH = 32
+# Weight of the latest run in the change rates of languages, see
+# update_language_state()
+_LANGUAGE_RATE_WEIGHT = 0.3
 
 # ################################ FUNCTIONS ################################# #
 
@@ -59,47 +133,295 @@ def run_subprocess(cmd, silent=False):
     return comm, exit_code
 
 
-def add_target_paths(config_files, repo, base_path, project_path):
-    # Add or remove the files given in the config files to the commit
-    count = 0
-    file_paths = []
+def load_config(config_files):
+    # Parse the given config files once, returning all of their file entries
+    config = []
     for f in config_files:
         fh = open(f, "r")
         try:
-            config = yaml.safe_load(fh)
-            for tf in config['files']:
-                if project_path in tf['source']:
-                    target_path = tf['translation']
-                    lang_codes = tf['languages_mapping']['android_code']
-                    for l in lang_codes:
-                        lpath = get_target_path(tf['translation'], tf['source'],
-                            lang_codes[l], project_path)
-                        file_paths.append(lpath)
+            config += yaml.safe_load(fh)['files']
         except yaml.YAMLError as e:
             print(e, '\n Could not parse YAML.')
             exit()
         fh.close()
+    return config
+
+
+def write_partial_config(config_file, sources, fh):
+    # Write the given config with only the file entries of the given sources,
+    # keeping credentials, base path and other settings
+    with open(config_file, 'r') as f:
+        partial = yaml.safe_load(f)
+    partial['files'] = [tf for tf in partial['files'] if tf['source'].lstrip('/') in sources]
+    yaml.safe_dump(partial, fh)
+    fh.flush()
+
+
+def load_config_index(config, shared=None):
+    # Expand every translation pattern of the config for all of its mapped
+    # languages. Expansions are kept in the given shared dict, so configs of
+    # other branches with the same entries and mappings reuse them.
+    # Returns a dict of source path -> frozenset of translation paths, both
+    # relative to the base path
+    shared = shared if shared is not None else {}
+    config_index = {}
+    lang_cache = {}
+    for tf in config:
+        # YAML aliases resolve to the very same object, so the shared
+        # language mapping only has to be expanded once
+        mapping = tf['languages_mapping']['android_code']
+        lang_codes = lang_cache.get(id(mapping))
+        if lang_codes is None:
+            lang_codes = tuple(mapping.values())
+            lang_codes = shared.setdefault(('langs', lang_codes), lang_codes)
+            lang_cache[id(mapping)] = lang_codes
+
+        key = ('targets', tf['translation'], tf['source'], lang_codes)
+        targets = shared.get(key)
+        if targets is None:
+            targets = frozenset(get_target_path(tf['translation'], tf['source'], l, '')
+                                for l in lang_codes)
+            shared[key] = targets
+
+        source = tf['source'].lstrip('/')
+        config_index[source] = config_index.get(source, frozenset()) | targets
+
+    return config_index
+
+
+def load_project_targets(config_index, resolver):
+    # The translation paths of every project, relative to the project root.
+    # The translations of a source belong to the innermost project holding it
+    project_targets = {}
+    for source, targets in config_index.items():
+        project_path, project = resolve_project(resolver, source)
+        if project_path is None:
+            continue
+        prefix = project_path + '/'
+        project_targets.setdefault(project_path, set()).update(
+            t[len(prefix):] for t in targets if t.startswith(prefix))
+    return {p: frozenset(targets) for p, targets in project_targets.items()}
 
-    # Strip all comments
-    for f in file_paths:
-        clean_xml_file(base_path, project_path, f)
 
-    # Modified and untracked files
-    modified = repo.git.ls_files(m=True, o=True)
-    for m in modified.split('\n'):
-        if m in file_paths:
-            repo.git.add(m)
-            count += 1
+def get_project_target_paths(project_targets, project_path):
+    # All translation paths of the given project, relative to the project root
+    return project_targets.get(project_path, frozenset())
+
+
+def get_project_root(path):
+    # Usually the project root is everything before /res
+    # but there are special cases where /res is part of the repo name as well
+    if "/res" not in path:
+        print(f'WARNING: Cannot determine project root dir of [{path}], skipping.')
+        return None
+
+    parts = path.split("/res")
+    if len(parts) == 2:
+        result = parts[0]
+    elif len(parts) == 3:
+        result = parts[0] + '/res' + parts[1]
+    else:
+        print(f'WARNING: Splitting the path not successful for [{path}], skipping')
+        return None
+
+    result = result.strip('/')
+    if result == path.strip('/'):
+        print(f'WARNING: Cannot determine project root dir of [{path}], skipping.')
+        return None
+    return result
+
+
+def load_project_resolver(xml_files):
+    # Put the <project> elements of all given manifests into a trie of their
+    # path components. On duplicate paths, the first project wins
+    resolver = {}
+    for xmlfile in xml_files:
+        for project in xmlfile.iter('project'):
+            node = resolver
+            for part in project.get('path').strip('/').split('/'):
+                node = node.setdefault(part, {})
+            node.setdefault(None, project)
+    return resolver
+
+
+def resolve_project(resolver, path):
+    # Find the project owning the given path. We want the longest match, so
+    # projects in subfolders of other projects are also taken into account.
+    # Returns the project's path and element, or (None, None)
+    resultPath = None
+    resultProject = None
+    node = resolver
+    parts = path.strip('/').split('/')
+    for i, part in enumerate(parts):
+        node = node.get(part)
+        if node is None:
+            break
+        if None in node:
+            resultPath = '/'.join(parts[:i + 1])
+            resultProject = node[None]
+    return resultPath, resultProject
+
+
+def add_target_paths(project_targets, repo, base_path, project_path, out=None, clean=True,
+                     stats=None):
+    # Add or remove the files given in the config files to the commit. The
+    # number of files without string changes, which are reverted instead, and
+    # the number of changed strings of every staged file are put in the
+    # optional stats dict
+    count = 0
+    file_paths = get_project_target_paths(project_targets, project_path)
+
+    # Strip all comments, unless the files were already cleaned in a batch
+    if clean:
+        for f in file_paths:
+            path = base_path + '/' + project_path + '/' + f
+            clean_stats = {}
+            result = clean_xml_file(base_path, project_path, f, out, clean_stats)
+            if result == _CLEAN_RESET and not reset_file(path, repo, out):
+                result = _CLEAN_FAILED
+            if result != _CLEAN_SKIPPED:
+                metrics_clean(metrics_repo(base_path, project_path), result, clean_stats)
+
+    # Modified, untracked and deleted files, staged all at once
+    changed = [f for f in get_changed_files(repo, file_paths) if f in file_paths]
+
+    # Exports which only differ in order, whitespace or escaping from HEAD
+    strings = get_string_changes(repo, changed)
+    unchanged = [f for f in changed if strings[f] == 0]
+    if unchanged:
+        with tempfile.TemporaryFile() as fh:
+            fh.write('\0'.join(unchanged).encode())
+            fh.seek(0)
+            repo.git.checkout('HEAD', '--pathspec-from-file=-', '--pathspec-file-nul', istream=fh)
+        metrics_count('files_unchanged', len(unchanged), metrics_repo(base_path, project_path))
+        changed = [f for f in changed if strings[f] != 0]
+    if stats is not None:
+        stats['unchanged'] = len(unchanged)
+        stats['strings'] = {f: strings[f] for f in changed}
+
+    if changed:
+        with tempfile.TemporaryFile() as fh:
+            fh.write('\0'.join(changed).encode())
+            fh.seek(0)
+            repo.git.add('-A', '--pathspec-from-file=-', '--pathspec-file-nul', istream=fh)
+        count = len(changed)
+
+    return count
+
+
+def get_changed_files(repo, file_paths):
+    # Files which differ between the working tree and the index, with a single
+    # git call limited to the directories of the given files
+    dirs = sorted({os.path.dirname(f) or '.' for f in file_paths})
+    if not dirs:
+        return []
+    status = repo.git.status('--porcelain', '-z', '--untracked-files=all', '--', *dirs)
+
+    changed = []
+    entries = iter(status.split('\0'))
+    for entry in entries:
+        if not entry:
+            continue
+        xy, path = entry[:2], entry[3:]
+        # Renames and copies are followed by their source path
+        if xy[0] in 'RC':
+            next(entries, None)
+        if xy[1] != ' ':
+            changed.append(path)
+    return changed
+
+
+def get_resource_value(elem, quoted=None):
+    # Text and inline markup (like xliff:g) of a resource element. Outside of
+    # quotes, aapt collapses runs of whitespace and trims both ends, so they
+    # are compared that way. Values holding quotes are compared as they are,
+    # and so are backslash escapes, which decide whether aapt accepts a value
+    top = quoted is None
+    if top:
+        quoted = '"' in ''.join(elem.xpath('.//text()'))
+
+    def text(t):
+        return (t or '') if quoted else re.sub(r'\s+', ' ', t or '')
+
+    value = [text(elem.text)]
+    for child in elem:
+        if isinstance(child.tag, str):
+            value.append((child.tag, tuple(sorted(child.attrib.items())),
+                          get_resource_value(child, quoted)))
+        value.append(text(child.tail))
+    if top and not quoted:
+        value[0] = value[0].lstrip()
+        value[-1] = value[-1].rstrip()
+    return tuple(value)
+
+
+def get_resource_map(data):
+    # The strings, plurals and arrays of a resources file by type, name and
+    # product, in a form which compares equal for equal translations. None if
+    # the file can't be parsed or defines a resource twice
+    try:
+        root = etree.fromstring(data)
+    except etree.XMLSyntaxError:
+        return None
+
+    resources = {}
+    for elem in root:
+        if not isinstance(elem.tag, str):
+            continue
+        attrib = dict(elem.attrib)
+        key = (elem.tag, attrib.pop('name', None), attrib.pop('product', None))
+        if key in resources:
+            return None
+        items = [i for i in elem if isinstance(i.tag, str)]
+        if elem.tag == 'plurals':
+            value = tuple(sorted(((i.get('quantity') or '', get_resource_value(i)) for i in items),
+                                 key=lambda i: i[0]))
+        elif elem.tag.endswith('array'):
+            value = tuple(get_resource_value(i) for i in items)
+        else:
+            value = get_resource_value(elem)
+        resources[key] = (tuple(sorted(attrib.items())), value)
+    return tuple(sorted(root.attrib.items())), resources
 
-    deleted = repo.git.ls_files(d=True)
-    for d in deleted.split('\n'):
-        if d in file_paths:
-            repo.git.rm(d)
-            count += 1
 
+def count_string_changes(old, new):
+    # Number of resources added, removed or changed between two resource
+    # maps, a change of the root attributes counting as one
+    if old is None or new is None:
+        return None
+    count = int(old[0] != new[0])
+    for key in old[1].keys() | new[1].keys():
+        count += old[1].get(key) != new[1].get(key)
     return count
 
 
+def get_string_changes(repo, file_paths):
+    # The number of changed strings of each of the given changed files,
+    # compared to HEAD. Files holding the same resources as in HEAD have
+    # none, new and deleted files at least one. None if a file can't be parsed
+    changes = {}
+    try:
+        tree = repo.head.commit.tree
+    except ValueError:
+        tree = None
+    for f in file_paths:
+        try:
+            head = (tree / f).data_stream.read() if tree is not None else None
+        except KeyError:
+            head = None
+        try:
+            with open(os.path.join(repo.working_tree_dir, f), 'rb') as fh:
+                data = fh.read()
+        except OSError:
+            data = None
+        if head is None or data is None:
+            resources = get_resource_map(head if data is None else data)
+            changes[f] = max(len(resources[1]), 1) if resources is not None else None
+        else:
+            changes[f] = count_string_changes(get_resource_map(head), get_resource_map(data))
+    return changes
+
+
 def split_path(path):
     # Split the given string to path and filename
     if '/' in path:
@@ -126,20 +448,29 @@ def get_target_path(pattern, source, lang, project_path):
     return target_path
 
 
-def clean_xml_file(base_path, project_path, filename):
+def clean_xml_file(base_path, project_path, filename, out=None, stats=None):
+    # Returns one of the _CLEAN_* results. Files which have to be reset are
+    # left for the caller, so only the caller touches the repository.
+    # Files which are already clean are not written, so git's stat cache
+    # stays valid for them, and the others are replaced atomically.
+    # The numbers of dropped strings and written bytes are added to stats
+    out = out or sys.stdout
+    stats = stats if stats is not None else {}
     path = base_path + '/' + project_path + '/' + filename
 
     # We don't want to create every file, just work with those already existing
     if not os.path.isfile(path):
-        return
+        return _CLEAN_SKIPPED
 
     try:
-        fh = open(path, 'r+')
+        with open(path, 'r') as fh:
+            XML = fh.read()
+            newlines = fh.newlines
     except:
-        print(f'\nSomething went wrong while opening file {path}')
-        return
+        print(f'\nSomething went wrong while opening file {path}', file=out)
+        return _CLEAN_SKIPPED
 
-    XML = fh.read()
+    original = XML
     content = ''
 
     # Take the original xml declaration and prepend it
@@ -151,26 +482,28 @@ def clean_xml_file(base_path, project_path, filename):
     try:
         tree = etree.fromstring(XML)
     except etree.XMLSyntaxError as err:
-        print(f'{filename}: XML Error: {err.error_log}')
+        print(f'{filename}: XML Error: {err.error_log}', file=out)
         filename, ext = os.path.splitext(path)
         if ext == '.xml':
-            reset_file(path, repo)
-        return
+            return _CLEAN_RESET
+        return _CLEAN_SKIPPED
 
     # Remove strings with 'product=*' attribute but no 'product=default'
     # This will ensure aapt2 will not throw an error when building these
-    productStrings = tree.xpath("//string[@product]")
-    alreadyRemoved = []
-    for ps in productStrings:
-        # if we already removed the items, don't process them
-        if ps in alreadyRemoved:
-            continue
-        stringName = ps.get('name')
-        stringsWithSameName = tree.xpath("//string[@name='{0}']".format(stringName))
-
+    # All strings, plurals and arrays are grouped by tag and name in one pass
+    sameName = {}
+    productKeys = {}
+    for element in tree.iter('string', 'plurals', 'string-array'):
+        key = (element.tag, element.get('name'))
+        sameName.setdefault(key, []).append(element)
+        if element.get('product') is not None:
+            productKeys[key] = True
+
+    for key in productKeys:
+        tag, stringName = key
         # We want to find strings with product='default' or no product attribute at all
         hasProductDefault = False
-        for string in stringsWithSameName:
+        for string in sameName[key]:
             product = string.get('product')
             if product is None or product == 'default':
                 hasProductDefault = True
@@ -179,11 +512,11 @@ def clean_xml_file(base_path, project_path, filename):
         # Every occurance of the string has to be removed when no string with the same name and
         # 'product=default' (or no product attribute) was found
         if not hasProductDefault:
-            print(f"\n{path}: Found string '{stringName}' with missing 'product=default' attribute",
-                  end='')
-            for string in stringsWithSameName:
-                tree.remove(string)
-                alreadyRemoved.append(string)
+            print(f"\n{path}: Found {tag} '{stringName}' with missing 'product=default' attribute",
+                  end='', file=out)
+            for string in sameName[key]:
+                string.getparent().remove(string)
+            stats['strings_dropped'] = stats.get('strings_dropped', 0) + len(sameName[key])
 
     header = ''
     comments = tree.xpath('//comment()')
@@ -195,6 +528,12 @@ def clean_xml_file(base_path, project_path, filename):
             continue
         p.remove(c)
 
+    # Remove files which don't have any translated strings
+    if len(tree) == 0:
+        print(f'\nRemoving {path}', file=out)
+        os.remove(path)
+        return _CLEAN_REMOVED
+
     # Take the original xml declaration and prepend it
     declaration = XML.split('\n')[0]
     if '<?' in declaration:
@@ -208,22 +547,185 @@ def clean_xml_file(base_path, project_path, filename):
     # Sometimes spaces are added, we don't want them
     content = re.sub("[ ]*<\/resources>", "</resources>", content)
 
-    # Overwrite file with content stripped by all comments
-    fh.seek(0)
-    fh.write(content)
-    fh.truncate()
-    fh.close()
+    # Keep the file if it is exactly like its cleaned version, line endings
+    # included, otherwise overwrite it with content stripped by all comments
+    if content == original and newlines in (None, '\n'):
+        stats['files_untouched'] = stats.get('files_untouched', 0) + 1
+        return _CLEAN_CLEANED
+    stats['bytes_written'] = stats.get('bytes_written', 0) + replace_file(path, content)
 
-    # Remove files which don't have any translated strings
-    contentList = list(tree)
-    if len(contentList) == 0:
-        print(f'\nRemoving {path}')
-        os.remove(path)
+    return _CLEAN_CLEANED
+
+
+@contextlib.contextmanager
+def atomic_write(path, mode='w'):
+    # Write to a temporary file next to path, which is synced to disk and
+    # renamed over path once written completely, so an interrupted run never
+    # leaves a half written file. The file keeps its permissions, and the
+    # temporary file is removed if writing fails
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or '.',
+                               prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as fh:
+            yield fh
+            fh.flush()
+            os.fsync(fh.fileno())
+        if os.path.exists(path):
+            shutil.copymode(path, tmp)
+        else:
+            os.chmod(tmp, 0o666 & ~_UMASK)
+        os.replace(tmp, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp)
+        raise
+
+
+def replace_file(path, content):
+    # Replace the file at path by content. Returns the number of written bytes
+    with atomic_write(path) as fh:
+        fh.write(content)
+        size = fh.tell()
+    return size
+
+
+def clean_xml_file_buffered(entry):
+    # Process pool worker: clean a (base_path, project_path, filename) entry
+    # and hand the result back together with the collected output and stats
+    out = io.StringIO()
+    stats = {}
+    start = time.monotonic()
+    try:
+        result = clean_xml_file(*entry, out=out, stats=stats)
+    except Exception as e:
+        print(f'\n{entry[2]}: {e}', file=out)
+        result = _CLEAN_FAILED
+    stats['seconds'] = time.monotonic() - start
+    return entry, result, out.getvalue(), stats
+
+
+def clean_xml_files_buffered(entries):
+    # Process pool worker: clean a batch of entries
+    return [clean_xml_file_buffered(e) for e in entries]
+
+
+def get_clean_state(caches=None):
+    # Results of cleaning files: a dict of result -> number of files, a
+    # dict of file path -> hash of the cleaned file (None if it does not
+    # exist) and the set of files which failed. Files which Crowdin exported
+    # exactly like in a previous run are taken from the cache of their base
+    # path in the given dict instead
+    return {'caches': caches or {}, 'counts': {}, 'hashes': {}, 'in_hashes': {}, 'repos': {},
+            'failed': set()}
+
+
+def clean_cached(clean, entries):
+    # Handle the given entries which don't exist or are in the cache. Returns
+    # the other ones, which have to be cleaned
+    counts = clean['counts']
+    misses = []
+    for entry in entries:
+        path = os.path.normpath('/'.join(entry))
+        # Not exported at all, nothing to clean
+        if not os.path.isfile(path):
+            counts[_CLEAN_SKIPPED] = counts.get(_CLEAN_SKIPPED, 0) + 1
+            clean['hashes'][path] = None
+            continue
+        cache = clean['caches'].get(entry[0])
+        if cache is None:
+            misses.append(entry)
+            continue
+        clean['in_hashes'][path] = file_hash(path)
+        stats = {}
+        result = apply_cached_clean(cache, entry[0], path, clean['in_hashes'][path], stats)
+        if result is None:
+            misses.append(entry)
+            continue
+        counts[result] = counts.get(result, 0) + 1
+        clean['hashes'][path] = file_hash(path)
+        metrics_clean(metrics_repo(entry[0], entry[1]), result, stats)
+    return misses
+
+
+def finish_clean(clean, entry, result, output, stats):
+    # Account a file cleaned by clean_xml_file_buffered. Files which have to be
+    # reset are checked out again here in the parent, so only one process
+    # touches each repository's index. Files failing to reset count as failed
+    base_path, project_path, filename = entry
+    print(output, end='')
+    if result == _CLEAN_RESET:
+        repo_path = os.path.join(base_path, project_path)
+        if repo_path not in clean['repos']:
+            clean['repos'][repo_path] = open_repo(repo_path)
+        if not reset_file(base_path + '/' + project_path + '/' + filename,
+                          clean['repos'][repo_path]):
+            result = _CLEAN_FAILED
+    counts = clean['counts']
+    counts[result] = counts.get(result, 0) + 1
+    metrics_clean(metrics_repo(base_path, project_path), result, stats)
+    path = os.path.normpath('/'.join(entry))
+    clean['hashes'][path] = file_hash(path)
+    if result == _CLEAN_FAILED:
+        clean['failed'].add(path)
+    if base_path in clean['caches']:
+        store_cached_clean(clean['caches'][base_path], base_path, path, result,
+                           clean['in_hashes'][path], stats)
+
+
+def open_clean_pool(jobs):
+    # Workers are started by a fork server instead of being forked from this
+    # process, where other threads may hold locks of lxml or of the standard
+    # streams, which a forked child would inherit held forever
+    return ProcessPoolExecutor(max_workers=jobs,
+                               mp_context=multiprocessing.get_context('forkserver'))
+
+
+def clean_xml_files(entries, jobs, caches=None):
+    # Clean all given (base_path, project_path, filename) entries, spread over
+    # a pool of processes, with the cache of their base path in the given dict.
+    # Returns a dict of result -> number of files and a dict of file path ->
+    # hash of the cleaned file (None if it does not exist)
+    clean = get_clean_state(caches)
+    misses = clean_cached(clean, entries)
+
+    if jobs <= 1:
+        results = (clean_xml_file_buffered(e) for e in misses)
+        executor = None
+    else:
+        executor = open_clean_pool(jobs)
+        chunksize = max(1, len(misses) // (jobs * 4))
+        results = executor.map(clean_xml_file_buffered, misses, chunksize=chunksize)
+
+    try:
+        for entry, result, output, stats in results:
+            finish_clean(clean, entry, result, output, stats)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        for repo in clean['repos'].values():
+            repo.close()
+
+    return clean['counts'], clean['hashes']
+
+
+def open_repo(path):
+    # Repositories are only opened once per process, so a daemon keeps them.
+    # The git processes each one starts for reading objects are stopped by
+    # Repo.close() once its work is done, it restarts them if needed again
+    path = os.path.normpath(path)
+    if os.path.basename(path) == '.git':
+        path = os.path.dirname(path)
+    repo = _REPOS.get(path)
+    if repo is None:
+        repo = _REPOS.setdefault(path, git.Repo(path, search_parent_directories=True))
+    return repo
 
 
 # For files we can't process due to errors, create a backup
-# and checkout the file to get it back to the previous state
-def reset_file(filepath, repo):
+# and checkout the file to get it back to the previous state.
+# Files git doesn't know yet are removed instead. Returns False
+# if the file couldn't be reset
+def reset_file(filepath, repo, err=None):
     backupFile = None
     parts = filepath.split("/")
     found = False
@@ -246,12 +748,28 @@ def reset_file(filepath, repo):
             i+=1
         backupFile = backupFile + str(i)
     shutil.copy(filepath, backupFile)
-    repo.git.checkout(filepath)
+    try:
+        if repo.git.ls_files(filepath):
+            repo.git.checkout(filepath)
+        else:
+            os.remove(filepath)
+    except (git.GitCommandError, OSError) as e:
+        print(f'\nFailed to reset {filepath}: {e}', file=err or sys.stderr)
+        return False
+    return True
 
 
-def push_as_commit(config_files, base_path, path, name, branch, username):
-    global _COMMITS_CREATED
-    print(f'\nCommitting {name} on branch {branch}: ', end='')
+def push_as_commit(project_targets, base_path, path, name, branch, username,
+                   out=None, err=None, push_lock=None, clean=True, open_changes=None,
+                   changes=None):
+    # Returns True if a commit was created and pushed, None if there was
+    # nothing to commit or push and False if committing or pushing failed.
+    # open_changes holds the current patch sets of open translation changes,
+    # commits with the same tree are not created. The number of changed
+    # strings of every committed file is put in the optional changes dict
+    out = out or sys.stdout
+    err = err or sys.stderr
+    print(f'\nCommitting {name} on branch {branch}: ', end='', file=out)
 
     # Get path
     project_path = path
@@ -260,83 +778,314 @@ def push_as_commit(config_files, base_path, path, name, branch, username):
         path = os.path.join(path, '.git')
 
     # Create repo object
-    repo = git.Repo(path)
+    repo = open_repo(path)
+    try:
+        metrics_name = metrics_repo(base_path, project_path)
+
+        # Add all files to commit
+        stats = {}
+        with metrics_phase('stage', metrics_name):
+            count = add_target_paths(project_targets, repo, base_path, project_path, out, clean,
+                                     stats)
+        metrics_count('files_staged', count, metrics_name)
+        if changes is not None:
+            changes.update(stats['strings'])
+
+        if count == 0 and stats['unchanged']:
+            print(f'No string changed in {stats["unchanged"]} files, skipping', file=out)
+            metrics_count('commits_avoided', 1, metrics_name)
+            return None
+        if count == 0:
+            print('Nothing to commit', file=out)
+            return None
+
+        # The staged files are left uncommitted when they are exactly like the
+        # open change, so nothing unpushed is left on HEAD
+        patch_set = (open_changes or {}).get((name, branch))
+        if patch_set is not None and is_same_tree(repo, name, username, patch_set):
+            print(f'Same as the open change {patch_set["url"]}, skipping', file=out)
+            metrics_count('pushes_avoided', 1, metrics_name)
+            return None
+
+        # Create commit; if it fails, probably empty so skipping
+        try:
+            with metrics_phase('commit', metrics_name):
+                repo.git.commit(m='Automatic AICP translation import')
+        except:
+            print('Failed, probably empty: skipping', file=err)
+            metrics_count('commits_failed', 1, metrics_name)
+            return False
 
-    # Add all files to commit
-    count = add_target_paths(config_files, repo, base_path, project_path)
+        # Push commit; the optional lock bounds the number of concurrent pushes
+        try:
+            if push_lock is not None:
+                push_lock.acquire()
+            try:
+                with metrics_phase('push', metrics_name):
+                    push_commit(repo, name, branch, username)
+            finally:
+                if push_lock is not None:
+                    push_lock.release()
+            print('Success', file=out)
+        except Exception as e:
+            print(e, '\nFailed to push!', file=err)
+            metrics_count('pushes_failed', 1, metrics_name)
+            # The files stay changed, so the next run commits them again
+            drop_commit(repo, err)
+            return False
 
-    if count == 0:
-        print('Nothing to commit')
-        return
+        metrics_count('commits_pushed', 1, metrics_name)
+        with _METRICS_LOCK:
+            _METRICS.setdefault('first_push', time.time())
+        return True
+    finally:
+        repo.close()
 
-    # Create commit; if it fails, probably empty so skipping
-    try:
-        repo.git.commit(m='Automatic AICP translation import')
-    except:
-        print('Failed, probably empty: skipping', file=sys.stderr)
-        return
 
-    # Push commit
+def drop_commit(repo, err=None):
+    # Undo the commit on HEAD, keeping its changes in the working tree
     try:
-        repo.git.push(f'ssh://{username}@gerrit.aicp-rom.com:29418/{name}',
-                      f'HEAD:refs/for/{branch}', '-o', f'topic=Translations-{branch}')
-        print('Success')
-    except Exception as e:
-        print(e, '\nFailed to push!', file=sys.stderr)
-        return
+        repo.git.reset('HEAD~1')
+    except git.GitCommandError as e:
+        print(f'\nFailed to drop the commit: {e}', file=err or sys.stderr)
 
-    _COMMITS_CREATED = True
 
+def get_gerrit_url(name, username):
+    if _GERRIT_PUSH_URL is not None:
+        return f'{_GERRIT_PUSH_URL}/{name}'
+    return f'ssh://{username}@{_GERRIT_HOST}:{_GERRIT_PORT}/{name}'
 
-def submit_gerrit(branch, username, owner):
-    # If an owner is specified, modify the query so we only get the ones wanted
-    ownerArg = ''
-    if owner is not None:
-        ownerArg = f'owner:{owner}'
 
-    # Find all open translation changes
-    cmd = ['ssh', '-p', '29418',
-        f'{username}@gerrit.aicp-rom.com',
-        'gerrit', 'query',
-        'status:open',
-        f'branch:{branch}',
-        ownerArg,
-        'message:"Automatic AICP translation import"',
-        f'topic:Translations-{branch}',
-        '--current-patch-set',
-        '--format=JSON']
-    commits = 0
-    msg, code = run_subprocess(cmd)
-    if code != 0:
-        print(f'Failed: {msg[1]}')
-        return
+def push_commit(repo, name, branch, username):
+    repo.git.push(get_gerrit_url(name, username), f'HEAD:refs/for/{branch}',
+                  '-o', f'topic=Translations-{branch}')
 
-    # Each line is one valid JSON object, except the last one, which is empty
-    for line in msg[0].strip('\n').split('\n'):
-        js = json.loads(line)
-        # We get valid JSON, but not every result line is a line we want
-        if not 'currentPatchSet' in js or not 'revision' in js['currentPatchSet']:
-            continue
-        # Add Code-Review +2 and Verified +1 labels and submit
-        cmd = ['ssh', '-p', '29418',
-        f'{username}@gerrit.aicp-rom.com',
+
+def is_same_tree(repo, name, username, patch_set):
+    # Whether the index has the tree of the given patch set, which is fetched
+    # unless it is still around from pushing it. Unknown counts as different
+    revision = patch_set['revision']
+    try:
+        if not repo.is_valid_object(revision, 'commit'):
+            repo.git.fetch(get_gerrit_url(name, username), patch_set['ref'])
+        return repo.git.rev_parse(f'{revision}^{{tree}}') == repo.git.write_tree()
+    except (git.GitCommandError, ValueError):
+        return False
+
+
+def push_as_commit_buffered(push_lock, clean, open_changes, changes, *args):
+    # Run push_as_commit with its output collected, so the logs of
+    # concurrently processed repositories don't interleave
+    out = io.StringIO()
+    err = io.StringIO()
+    try:
+        created = push_as_commit(*args, out=out, err=err, push_lock=push_lock, clean=clean,
+                                 open_changes=open_changes, changes=changes)
+    except Exception as e:
+        print(e, '\nFailed to commit!', file=err)
+        created = False
+    return created, out.getvalue(), err.getvalue()
+
+
+def gerrit_ssh(username, control_path=None):
+    # Base command for running gerrit commands via ssh, optionally through a
+    # shared master connection
+    cmd = _GERRIT_SSH + ['-p', _GERRIT_PORT]
+    if control_path is not None:
+        cmd += ['-o', f'ControlPath={control_path}', '-o', 'ControlMaster=no']
+    return cmd + [f'{username}@{_GERRIT_HOST}']
+
+
+def open_gerrit_master(username, control_path):
+    # Open a master connection in the background, so all following ssh calls
+    # share it instead of doing their own handshake. It is closed when done,
+    # and exits by itself after a minute without calls if the script is killed
+    cmd = _GERRIT_SSH + ['-p', _GERRIT_PORT,
+                         '-o', f'ControlPath={control_path}',
+                         '-o', 'ControlMaster=yes',
+                         '-o', f'ControlPersist={_GERRIT_PERSIST}',
+                         '-f', '-N', f'{username}@{_GERRIT_HOST}']
+    # Don't use pipes here, the backgrounded master would keep them open
+    ret = subprocess.call(cmd, stdin=subprocess.DEVNULL,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return ret == 0
+
+
+def close_gerrit_master(username, control_path):
+    cmd = _GERRIT_SSH + ['-p', _GERRIT_PORT,
+                         '-o', f'ControlPath={control_path}',
+                         '-O', 'exit', f'{username}@{_GERRIT_HOST}']
+    run_subprocess(cmd, True)
+
+
+def query_gerrit(username, control_path, query):
+    # Run "gerrit query" for the given query and yield every change having a
+    # current patch set as soon as its line arrives. Gerrit returns a limited
+    # number of changes at once, so the query is continued with --start as
+    # long as it reports moreChanges. Changes submitted in the meantime drop
+    # out of open queries and shift the later pages, so after a query of
+    # several pages, it runs again until it finds no new changes. Pages
+    # failing to connect are retried.
+    # Raises CalledProcessError if a query fails
+    seen = set()
+    while True:
+        start = 0
+        pages = 0
+        new = 0
+        more = True
+        while more:
+            page_start = start
+            for attempt in range(_GERRIT_RETRIES):
+                if attempt > 0:
+                    time.sleep(attempt)
+                # Changes of a page which failed halfway were already seen
+                start = page_start
+                cmd = gerrit_ssh(username, control_path) + [
+                    'gerrit', 'query', *query,
+                    '--current-patch-set',
+                    '--format=JSON',
+                    '--start', str(start)]
+                more = False
+                error = None
+                with tempfile.TemporaryFile('w+') as err:
+                    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=err,
+                                         universal_newlines=True)
+                    try:
+                        # Each line is one valid JSON object, the last one
+                        # holds the stats of the query
+                        for line in p.stdout:
+                            if not line.strip():
+                                continue
+                            js = json.loads(line)
+                            if js.get('type') == 'stats':
+                                more = js.get('moreChanges', False)
+                                continue
+                            if js.get('type') == 'error':
+                                error = js.get('message')
+                                continue
+                            start += 1
+                            # We get valid JSON, but not every result line is a line we want
+                            if 'revision' not in js.get('currentPatchSet', {}):
+                                continue
+                            if js.get('number') in seen:
+                                continue
+                            seen.add(js.get('number'))
+                            new += 1
+                            yield js
+                    finally:
+                        if p.poll() is None:
+                            p.kill()
+                        code = p.wait()
+                    err.seek(0)
+                    stderr = err.read()
+                if code == 255 and error is None and attempt < _GERRIT_RETRIES - 1:
+                    print(f'Query failed, retrying: {stderr.strip()}', file=sys.stderr)
+                    continue
+                if code != 0 or error is not None:
+                    raise subprocess.CalledProcessError(code, cmd, stderr=error or stderr)
+                break
+            pages += 1
+        if pages == 1 or new == 0:
+            return
+
+
+def get_open_changes(username, branches):
+    # The current patch sets of the open translation changes of all given
+    # branches by project and branch, found with a single query. Empty if it
+    # fails, then everything is pushed
+    topics = ' OR '.join(f'topic:Translations-{b}' for b in sorted(branches))
+    query = ['status:open',
+             'message:"Automatic AICP translation import"',
+             f'"({topics})"']
+    try:
+        return {(js['project'], js['branch']): dict(js['currentPatchSet'], url=js.get('url'))
+                for js in query_gerrit(username, None, query)}
+    except subprocess.CalledProcessError as e:
+        print(f'Could not query open changes, pushing all commits: {e.stderr.strip()}',
+              file=sys.stderr)
+        return {}
+
+
+def submit_change(username, control_path, revision):
+    # Add Code-Review +2 and Verified +1 labels and submit, retrying when the
+    # connection fails
+    cmd = gerrit_ssh(username, control_path) + [
         'gerrit', 'review',
         '--verified +1',
         '--code-review +2',
-        '--submit', js['currentPatchSet']['revision']]
+        '--submit', revision]
+    for attempt in range(_GERRIT_RETRIES):
+        if attempt > 0:
+            time.sleep(attempt)
         msg, code = run_subprocess(cmd, True)
-        print('Submitting commit %s: ' % js['url'], end='')
-        if code != 0:
-            errorText = msg[1].replace('\n\n', '; ').replace('\n', '')
-            print(f'Failed: {errorText}')
-        else:
-            print('Success')
+        if code != 255:
+            break
+    return msg, code
 
-        commits += 1
 
-    if commits == 0:
-        print("Nothing to submit!")
-        return
+def submit_gerrit(branch, username, owner, jobs=1):
+    # Returns False if the open changes couldn't all be queried
+    # If an owner is specified, modify the query so we only get the ones wanted
+    ownerArg = ''
+    if owner is not None:
+        ownerArg = f'owner:{owner}'
+
+    control_dir = tempfile.mkdtemp(prefix='crowdin_sync_')
+    control_path = os.path.join(control_dir, 'gerrit')
+    if not open_gerrit_master(username, control_path):
+        print('Could not open a shared ssh connection, connecting once per change')
+        control_path = None
+
+    try:
+        # Find all open translation changes, submitting each one as soon as
+        # it arrives while later ones are still being queried
+        query = ['status:open',
+                 f'branch:{branch}',
+                 ownerArg,
+                 'message:"Automatic AICP translation import"',
+                 f'topic:Translations-{branch}']
+        changes = []
+        futures = []
+        failed = []
+        query_error = None
+        with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+            try:
+                for js in query_gerrit(username, control_path, query):
+                    changes.append(js)
+                    futures.append(executor.submit(submit_change, username, control_path,
+                                                   js['currentPatchSet']['revision']))
+            except subprocess.CalledProcessError as e:
+                query_error = (e.stderr or '').strip() or f'exit code {e.returncode}'
+                print(f'Failed to query open changes: {query_error}')
+                metrics_count('queries_failed')
+
+            if len(changes) == 0:
+                if query_error is None:
+                    print("Nothing to submit!")
+                return query_error is None
+
+            for js, future in zip(changes, futures):
+                msg, code = future.result()
+                print('Submitting commit %s: ' % js['url'], end='')
+                if code != 0:
+                    errorText = msg[1].replace('\n\n', '; ').replace('\n', '')
+                    print(f'Failed: {errorText}')
+                    failed.append(js['url'])
+                    metrics_count('changes_failed')
+                else:
+                    print('Success')
+                    metrics_count('changes_submitted')
+
+        print(f'\nSubmitted {len(changes) - len(failed)} of {len(changes)} changes')
+        for url in failed:
+            print(f'Failed: {url}')
+        if query_error is not None:
+            print(f'The query failed, more changes may be open: {query_error}')
+        return query_error is None
+    finally:
+        if control_path is not None:
+            close_gerrit_master(username, control_path)
+        shutil.rmtree(control_dir, ignore_errors=True)
 
 
 def check_run(cmd):
@@ -354,6 +1103,788 @@ def find_xml(base_path):
             if os.path.splitext(f)[1] == '.xml':
                 yield os.path.join(dp, f)
 
+# ############################### CROWDIN API ################################ #
+
+
+def open_crowdin_api(config, jobs):
+    # Everything the API backend needs: a session whose connection pool is
+    # shared by all worker threads, and the parsed config to map the exported
+    # files to their local paths
+    token = os.getenv(_CROWDIN_API_TOKEN_ENV)
+    if token is None:
+        print(f'You have not set {_CROWDIN_API_TOKEN_ENV}.', file=sys.stderr)
+        sys.exit(1)
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=jobs)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['Authorization'] = f'Bearer {token}'
+    return {'session': session, 'config': config, 'jobs': jobs}
+
+
+def crowdin_request(api, method, path, **kwargs):
+    r = api['session'].request(method, _CROWDIN_API_URL + path, **kwargs)
+    r.raise_for_status()
+    if not r.content:
+        return None
+    return r.json()['data']
+
+
+def crowdin_list(api, path, params=None):
+    # Fetch all pages of a list endpoint
+    params = dict(params or {}, limit=500, offset=0)
+    while True:
+        data = crowdin_request(api, 'GET', path, params=params)
+        for item in data:
+            yield item['data']
+        if len(data) < params['limit']:
+            return
+        params['offset'] += params['limit']
+
+
+def get_crowdin_branch_id(api, project_id, branch):
+    for b in crowdin_list(api, f'/projects/{project_id}/branches', {'name': branch}):
+        if b['name'] == branch:
+            return b['id']
+    print(f'There is no branch {branch} on Crowdin.', file=sys.stderr)
+    sys.exit(1)
+
+
+def get_crowdin_file_ids(api, project_id, branch, branch_id):
+    # Returns a dict of source path -> Crowdin file id
+    file_ids = {}
+    for f in crowdin_list(api, f'/projects/{project_id}/files', {'branchId': branch_id}):
+        # Paths of files in branches start with the branch's folder
+        path = f['path'].lstrip('/')
+        if path.startswith(branch + '/'):
+            path = path[len(branch) + 1:]
+        file_ids[path] = f['id']
+    return file_ids
+
+
+def get_translation_matchers(config):
+    # Compile the translation pattern of every config entry into a regex
+    # matching the exported file, capturing Crowdin's android code
+    matchers = []
+    for tf in config:
+        original_path, original_file_name = split_path(tf['source'])
+        pattern = re.escape(tf['translation'].lstrip('/'))
+        pattern = pattern.replace(re.escape('%original_path%'),
+                                  re.escape(original_path.lstrip('/')))
+        pattern = pattern.replace(re.escape('%original_file_name%'),
+                                  re.escape(original_file_name))
+        pattern = pattern.replace(re.escape('%android_code%'), '(?P<code>[^/]+)', 1)
+        pattern = pattern.replace(re.escape('%android_code%'), '(?P=code)')
+        matchers.append((re.compile(pattern), tf))
+    return matchers
+
+
+def get_local_translation_path(matchers, lang, name):
+    # Map a file of a language's export archive to its path relative to the
+    # base path, using the language mapping of the config
+    for regex, tf in matchers:
+        m = regex.fullmatch(name)
+        if m is None:
+            continue
+        code = tf['languages_mapping']['android_code'].get(lang, m.groupdict().get('code'))
+        return get_target_path(tf['translation'], tf['source'], code, '')
+    return None
+
+
+def download_language_api(api, project_id, branch, branch_id, lang, base_path, matchers):
+    # Build the translations of one language, stream the archive to disk and
+    # unpack it. Returns the number of unpacked files
+    build = crowdin_request(api, 'POST', f'/projects/{project_id}/translations/builds',
+                            json={'branchId': branch_id,
+                                  'targetLanguageIds': [lang],
+                                  'skipUntranslatedStrings': True,
+                                  'exportApprovedOnly': True})
+    path = f'/projects/{project_id}/translations/builds/{build["id"]}'
+    while build['status'] in ('created', 'inProgress'):
+        time.sleep(_CROWDIN_BUILD_POLL)
+        build = crowdin_request(api, 'GET', path)
+    if build['status'] != 'finished':
+        raise RuntimeError(f'Build of {lang} failed: {build["status"]}')
+
+    url = crowdin_request(api, 'GET', f'{path}/download')['url']
+    count = 0
+    with tempfile.TemporaryFile() as archive:
+        # The download link is pre-signed, our token must not be sent along
+        with api['session'].get(url, stream=True, headers={'Authorization': None}) as r:
+            r.raise_for_status()
+            for chunk in r.iter_content(chunk_size=1 << 16):
+                archive.write(chunk)
+
+        with zipfile.ZipFile(archive) as z:
+            for info in z.infolist():
+                if info.is_dir():
+                    continue
+                name = info.filename.lstrip('/')
+                # Files of branches may be exported within the branch's folder
+                if name.startswith(branch + '/'):
+                    name = name[len(branch) + 1:]
+                target = get_local_translation_path(matchers, lang, name)
+                if target is None:
+                    continue
+                target = os.path.join(base_path, target)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with z.open(info) as src, open(target, 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+                count += 1
+    return count
+
+
+def download_api(api, project_id, base_path, branch, deferred=()):
+    # Request the builds of all target languages but the deferred ones at
+    # once and unpack them as soon as they are finished
+    try:
+        project = crowdin_request(api, 'GET', f'/projects/{project_id}')
+        branch_id = get_crowdin_branch_id(api, project_id, branch)
+        matchers = get_translation_matchers(api['config'])
+        with ThreadPoolExecutor(max_workers=api['jobs']) as executor:
+            futures = {lang: executor.submit(download_language_api, api, project_id, branch,
+                                             branch_id, lang, base_path, matchers)
+                       for lang in project['targetLanguageIds'] if lang not in deferred}
+            for lang, future in futures.items():
+                print(f'Downloaded {lang}: {future.result()} files')
+    except (requests.RequestException, RuntimeError) as e:
+        print(f'Failed to download translations: {e}', file=sys.stderr)
+        sys.exit(1)
+
+
+def download_file_api(api, project_id, file_id, lang, target, etag):
+    # Export one file in one language, unless it is unchanged since the export
+    # with the given etag. Returns the new etag or None if unchanged
+    headers = {'If-None-Match': etag} if etag else {}
+    export = crowdin_request(api, 'POST',
+                             f'/projects/{project_id}/translations/builds/files/{file_id}',
+                             json={'targetLanguageId': lang,
+                                   'skipUntranslatedStrings': True,
+                                   'exportApprovedOnly': True},
+                             headers=headers)
+    if export is None:
+        return None
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    # The download link is pre-signed, our token must not be sent along
+    with api['session'].get(export['url'], stream=True, headers={'Authorization': None}) as r:
+        r.raise_for_status()
+        with atomic_write(target, 'wb') as fh:
+            for chunk in r.iter_content(chunk_size=1 << 16):
+                fh.write(chunk)
+    return export['etag']
+
+
+def download_incremental_api(api, project_id, base_path, branch, sync_state, deferred=(),
+                             arrived=None):
+    # Export only the files and languages which changed since the exports
+    # recorded in the sync state, skipping the deferred languages. Returns the
+    # set of changed translation paths, relative to the base path. Each one
+    # is also passed to the optional arrived(path) as soon as it is written
+    try:
+        project = crowdin_request(api, 'GET', f'/projects/{project_id}')
+        langs = {l: l for l in project['targetLanguageIds']}
+        for l in project.get('targetLanguages', []):
+            langs[l['id']] = l.get('androidCode') or l['id']
+        langs = {l: code for l, code in langs.items() if l not in deferred}
+        branch_id = get_crowdin_branch_id(api, project_id, branch)
+        file_ids = get_crowdin_file_ids(api, project_id, branch, branch_id)
+
+        with ThreadPoolExecutor(max_workers=api['jobs']) as executor:
+            futures = {}
+            for tf in api['config']:
+                source = tf['source'].lstrip('/')
+                if source not in file_ids:
+                    print(f'WARNING: {source} is not on Crowdin, skipping', file=sys.stderr)
+                    continue
+                mapping = tf['languages_mapping']['android_code']
+                for lang, android_code in langs.items():
+                    target = get_target_path(tf['translation'], tf['source'],
+                                             mapping.get(lang, android_code), '')
+                    key = f'{lang}/{source}'
+                    futures[key] = (target, executor.submit(
+                        download_file_api, api, project_id, file_ids[source], lang,
+                        os.path.join(base_path, target), sync_state['files'].get(key)))
+
+            changed = set()
+            targets = {future: (key, target) for key, (target, future) in futures.items()}
+            for future in as_completed(targets):
+                key, target = targets[future]
+                etag = future.result()
+                if etag is not None:
+                    sync_state['files'][key] = etag
+                    sync_state['targets'][key] = target
+                    changed.add(target)
+                    if arrived is not None:
+                        arrived(target)
+    except (requests.RequestException, OSError) as e:
+        print(f'Failed to download translations: {e}', file=sys.stderr)
+        sys.exit(1)
+
+    print(f'Downloaded {len(changed)} changed of {len(futures)} files')
+    return changed
+
+
+def load_sync_state(cache_dir, branch):
+    # The etags of the exports of the last incremental download. Without it,
+    # everything is downloaded again. The translation paths of the files
+    # exported in this run are only kept until it is saved
+    sync_state = {'path': os.path.join(cache_dir, f'{branch}_sync.json'), 'files': {},
+                  'targets': {}}
+    try:
+        with open(sync_state['path'], 'r') as fh:
+            sync_state['files'] = json.load(fh)['files']
+    except (OSError, ValueError, KeyError):
+        pass
+    return sync_state
+
+
+def save_sync_state(sync_state):
+    os.makedirs(os.path.dirname(sync_state['path']), exist_ok=True)
+    with atomic_write(sync_state['path']) as fh:
+        json.dump({'files': sync_state['files']}, fh)
+    sync_state['targets'] = {}
+
+
+def forget_exports(sync_state, base_path, paths):
+    # Drop the etags of the files exported in this run to the given
+    # translation paths, so the next run exports them again
+    for key, target in list(sync_state['targets'].items()):
+        if os.path.normpath(os.path.join(base_path, target)) in paths:
+            sync_state['files'].pop(key, None)
+            del sync_state['targets'][key]
+
+
+def get_source_hash(base_path, tf):
+    # Hash of a config entry and its source file in canonical form, so changes
+    # in indentation, attribute order or quoting don't count as changes.
+    # Comments are kept, Crowdin shows them as context of the strings
+    try:
+        with open(os.path.join(base_path, tf['source'].lstrip('/')), 'rb') as fh:
+            data = fh.read()
+    except OSError:
+        return None
+    try:
+        parser = etree.XMLParser(remove_blank_text=True)
+        data = etree.tostring(etree.fromstring(data, parser), method='c14n')
+    except etree.XMLSyntaxError:
+        pass
+    source_hash = hashlib.sha1(json.dumps(tf, sort_keys=True).encode())
+    source_hash.update(data)
+    return source_hash.hexdigest()
+
+
+def get_source_hashes(base_path, config, sources=None):
+    # Hashes of all sources of the config, or only of the given ones. A source
+    # listed several times hashes all of its entries
+    hashes = {}
+    for tf in config:
+        source = tf['source'].lstrip('/')
+        if sources is not None and source not in sources:
+            continue
+        source_hash = get_source_hash(base_path, tf)
+        if source_hash is None:
+            continue
+        if source in hashes:
+            source_hash = hashlib.sha1((hashes[source] + source_hash).encode()).hexdigest()
+        hashes[source] = source_hash
+    return hashes
+
+
+def load_source_state(cache_dir, branch):
+    # The source hashes of the last successful upload. Without it, all
+    # sources are uploaded again
+    source_state = {'path': os.path.join(cache_dir, f'{branch}_sources.json'), 'sources': {}}
+    try:
+        with open(source_state['path'], 'r') as fh:
+            source_state['sources'] = json.load(fh)['sources']
+    except (OSError, ValueError, KeyError):
+        pass
+    return source_state
+
+
+def save_source_state(source_state):
+    os.makedirs(os.path.dirname(source_state['path']), exist_ok=True)
+    with atomic_write(source_state['path']) as fh:
+        json.dump({'sources': source_state['sources']}, fh)
+
+
+def upload_source_api(api, project_id, file_id, path):
+    with open(path, 'rb') as fh:
+        storage = crowdin_request(api, 'POST', '/storages', data=fh,
+                                  headers={'Crowdin-API-FileName': os.path.basename(path),
+                                           'Content-Type': 'application/octet-stream'})
+    crowdin_request(api, 'PUT', f'/projects/{project_id}/files/{file_id}',
+                    json={'storageId': storage['id']})
+
+
+def upload_sources_api(api, project_id, base_path, branch, sources=None):
+    # Update all sources which already exist on Crowdin concurrently, or only
+    # the given ones. Returns the uploaded ones
+    if sources is None:
+        sources = {tf['source'].lstrip('/') for tf in api['config']}
+    uploaded = set()
+    try:
+        branch_id = get_crowdin_branch_id(api, project_id, branch)
+        file_ids = get_crowdin_file_ids(api, project_id, branch, branch_id)
+
+        with ThreadPoolExecutor(max_workers=api['jobs']) as executor:
+            futures = {}
+            for source in sorted(sources):
+                if source not in file_ids:
+                    print(f'WARNING: {source} is not on Crowdin yet, '
+                          'upload it once using the crowdin CLI', file=sys.stderr)
+                    continue
+                futures[source] = executor.submit(upload_source_api, api, project_id,
+                                                  file_ids[source], f'{base_path}/{source}')
+            for source, future in futures.items():
+                future.result()
+                uploaded.add(source)
+                print(f'Uploaded {source}')
+    except (requests.RequestException, OSError) as e:
+        print(f'Failed to upload sources: {e}', file=sys.stderr)
+        sys.exit(1)
+    return uploaded
+
+
+# ################################## CACHE ################################### #
+
+
+def file_hash(path):
+    try:
+        with open(path, 'rb') as fh:
+            return hashlib.sha1(fh.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def load_cache(cache_dir, branch, config_files):
+    # The cache only holds results of the current config and cleaning code,
+    # anything else found in it is discarded. It is always safe to delete.
+    config_hash = hashlib.sha1(str(_CACHE_VERSION).encode())
+    for f in config_files:
+        with open(f, 'rb') as fh:
+            config_hash.update(fh.read())
+
+    cache = {
+        'path': os.path.join(cache_dir, f'{branch}.json'),
+        'blobs': os.path.join(cache_dir, 'blobs'),
+        'config': config_hash.hexdigest(),
+        'files': {},
+        'repos': {},
+        'hits': 0,
+        'misses': 0,
+    }
+    try:
+        with open(cache['path'], 'r') as fh:
+            data = json.load(fh)
+        if data.get('config') == cache['config']:
+            cache['files'] = data['files']
+            cache['repos'] = data['repos']
+    except (OSError, ValueError, KeyError):
+        pass
+    return cache
+
+
+def save_cache(cache):
+    # Saved after every run, so the hits and misses are counted per run
+    os.makedirs(os.path.dirname(cache['path']), exist_ok=True)
+    data = {k: cache[k] for k in ('config', 'files', 'repos')}
+    with atomic_write(cache['path']) as fh:
+        json.dump(data, fh)
+    print(f"\nCache: {cache['hits']} hits, {cache['misses']} misses")
+    metrics_count('cache_hits', cache['hits'])
+    metrics_count('cache_misses', cache['misses'])
+    cache['hits'] = cache['misses'] = 0
+
+
+def prune_cache_blobs(cache_dir):
+    # Remove the cleaned files which no saved cache of any branch refers to
+    # anymore. Runs once the caches of all branches of the run are saved
+    blobs = os.path.join(cache_dir, 'blobs')
+    if not os.path.isdir(blobs):
+        return
+    used = set()
+    for name in os.listdir(cache_dir):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(cache_dir, name), 'r') as fh:
+                data = json.load(fh)
+            if not isinstance(data, dict) or not {'config', 'files', 'repos'} <= data.keys():
+                continue
+            used.update(record['out'] for record in data['files'].values())
+        except (OSError, ValueError, KeyError, TypeError):
+            # Blobs of a cache which can't be read are not known to be unused
+            return
+    removed = 0
+    for name in os.listdir(blobs):
+        if name not in used:
+            os.remove(os.path.join(blobs, name))
+            removed += 1
+    if removed:
+        print(f'Cache: removed {removed} unused cleaned files')
+
+
+def lookup_cache(cache, key, in_hash):
+    # Returns the record of a file exported exactly like in a previous run
+    record = cache['files'].get(key)
+    if in_hash is not None and record is not None and record['in'] == in_hash:
+        cache['hits'] += 1
+        return record
+    cache['misses'] += 1
+    return None
+
+
+def apply_cached_clean(cache, base_path, path, in_hash, stats):
+    # Replace a downloaded file by its cached cleaned version, or remove it if
+    # it was empty. Returns the _CLEAN_* result or None if not cached
+    record = lookup_cache(cache, os.path.relpath(path, base_path), in_hash)
+    if record is None:
+        return None
+    stats['strings_dropped'] = record.get('dropped', 0)
+    if record['out'] is None:
+        print(f'\nRemoving {path}')
+        os.remove(path)
+        return _CLEAN_REMOVED
+    # Exports which are already clean are kept as they are
+    if record['out'] == in_hash:
+        stats['files_untouched'] = 1
+        return _CLEAN_CLEANED
+    blob = os.path.join(cache['blobs'], record['out'])
+    if not os.path.isfile(blob):
+        return None
+    with open(blob, 'rb') as src, atomic_write(path, 'wb') as fh:
+        shutil.copyfileobj(src, fh)
+    stats['bytes_written'] = os.path.getsize(path)
+    return _CLEAN_CLEANED
+
+
+def store_cached_clean(cache, base_path, path, result, in_hash, stats):
+    # Remember the result of cleaning the downloaded file with the given hash
+    key = os.path.relpath(path, base_path)
+    if in_hash is None or result not in (_CLEAN_CLEANED, _CLEAN_REMOVED):
+        cache['files'].pop(key, None)
+        return
+
+    out_hash = None
+    if result == _CLEAN_CLEANED:
+        out_hash = file_hash(path)
+        blob = os.path.join(cache['blobs'], out_hash)
+        if not os.path.isfile(blob):
+            os.makedirs(cache['blobs'], exist_ok=True)
+            with open(path, 'rb') as src, atomic_write(blob, 'wb') as fh:
+                shutil.copyfileobj(src, fh)
+    cache['files'][key] = {'in': in_hash, 'out': out_hash,
+                           'dropped': stats.get('strings_dropped', 0)}
+
+
+def get_repo_state(base_path, project_path, file_paths, hashes):
+    # Everything that decides about the outcome of staging a repository
+    repo = open_repo(os.path.join(base_path, project_path))
+    files = {f: hashes.get(os.path.normpath(f'{base_path}/{project_path}/{f}'))
+             for f in sorted(file_paths)}
+    return {'head': repo.git.rev_parse('HEAD'), 'files': files}
+
+# ################################# METRICS ################################## #
+
+
+@contextlib.contextmanager
+def metrics_phase(name, repo=None):
+    # Time the enclosed code as part of the given phase, and of the given
+    # repository if any. Phases may run several times and concurrently, so
+    # both the wall time from their first start to their last end and the
+    # summed time of all runs are kept
+    run = metrics_start(name)
+    try:
+        yield
+    finally:
+        metrics_end(run, repo)
+
+
+def metrics_start(name):
+    # Start a run of the given phase, profiling it with --profile. Returns
+    # the handle to pass to metrics_end()
+    profile = start_profile() if _PROFILE_DIR is not None else None
+    return name, time.monotonic(), profile
+
+
+def metrics_end(run, repo=None):
+    name, start, profile = run
+    end = time.monotonic()
+    if profile is not None:
+        stop_profile(name, profile)
+    with _METRICS_LOCK:
+        phase = _METRICS['phases'].setdefault(
+            name, {'first': start, 'last': end, 'busy': 0.0, 'runs': 0})
+        phase['first'] = min(phase['first'], start)
+        phase['last'] = max(phase['last'], end)
+        phase['busy'] += end - start
+        phase['runs'] += 1
+        if repo is not None:
+            add_repo_seconds(repo, name, end - start)
+
+
+def add_repo_seconds(repo, name, seconds):
+    # Callers hold _METRICS_LOCK
+    repo_seconds = _METRICS['repos'].setdefault(repo, {'seconds': {}})['seconds']
+    repo_seconds[name] = repo_seconds.get(name, 0) + seconds
+
+
+def metrics_count(key, n=1, repo=None):
+    with _METRICS_LOCK:
+        counts = _METRICS['counts']
+        counts[key] = counts.get(key, 0) + n
+        if repo is not None:
+            repo_counts = _METRICS['repos'].setdefault(repo, {'seconds': {}})
+            repo_counts[key] = repo_counts.get(key, 0) + n
+
+
+def metrics_repo(base_path, project_path):
+    # Name of a repository in the metrics. When several branches are synced,
+    # their base paths are mapped to the branch names to tell them apart
+    branch = _METRICS['bases'].get(base_path)
+    if branch is None:
+        return project_path
+    return f'{branch}:{project_path}'
+
+
+def metrics_clean(repo, result, stats):
+    # Account the result and stats of cleaning one file of the given repository.
+    # Files are cleaned in other processes, so their time is added up here
+    metrics_count(f'files_{result}', 1, repo)
+    for key in ('strings_dropped', 'bytes_written', 'files_untouched'):
+        if stats.get(key):
+            metrics_count(key, stats[key], repo)
+    if 'seconds' in stats:
+        with _METRICS_LOCK:
+            add_repo_seconds(repo, 'clean', stats['seconds'])
+
+
+def get_metrics():
+    # The metrics of this run as they are written to the JSON file
+    with _METRICS_LOCK:
+        phases = {name: {'seconds': round(p['last'] - p['first'], 3),
+                         'busy_seconds': round(p['busy'], 3),
+                         'runs': p['runs']}
+                  for name, p in _METRICS['phases'].items()}
+        metrics = {
+            'branch': _METRICS.get('branch'),
+            'start': round(_METRICS['start'], 3),
+            'seconds': round(time.time() - _METRICS['start'], 3),
+            'first_push_seconds': None,
+            'phases': phases,
+            'counts': dict(_METRICS['counts']),
+            'repos': json.loads(json.dumps(_METRICS['repos'])),
+        }
+        if 'first_push' in _METRICS:
+            metrics['first_push_seconds'] = round(_METRICS['first_push'] - _METRICS['start'], 3)
+    for r in metrics['repos'].values():
+        r['seconds'] = {k: round(v, 3) for k, v in r['seconds'].items()}
+    return metrics
+
+
+def reset_metrics():
+    # Start over, e.g. for the next cycle of the daemon
+    with _METRICS_LOCK:
+        _METRICS['start'] = time.time()
+        _METRICS.pop('first_push', None)
+        for key in ('phases', 'counts', 'repos'):
+            _METRICS[key] = {}
+
+
+def format_prometheus(metrics):
+    # Render the metrics for the textfile collector of the node exporter
+    lines = []
+
+    def add(name, help_text, samples):
+        lines.append(f'# HELP crowdin_sync_{name} {help_text}')
+        lines.append(f'# TYPE crowdin_sync_{name} gauge')
+        for labels, value in samples:
+            labels = dict({'branch': metrics['branch'] or ''}, **labels)
+            text = ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                            for k, v in labels.items())
+            lines.append(f'crowdin_sync_{name}{{{text}}} {value}')
+
+    add('last_run_timestamp_seconds', 'Start time of the last sync', [({}, metrics['start'])])
+    add('duration_seconds', 'Duration of the last sync', [({}, metrics['seconds'])])
+    if metrics['first_push_seconds'] is not None:
+        add('first_push_seconds', 'Time from the start of the last sync to its first push',
+            [({}, metrics['first_push_seconds'])])
+    add('phase_seconds', 'Wall time of a phase of the last sync',
+        [({'phase': n}, p['seconds']) for n, p in metrics['phases'].items()])
+    add('phase_busy_seconds', 'Summed time of all runs of a phase of the last sync',
+        [({'phase': n}, p['busy_seconds']) for n, p in metrics['phases'].items()])
+    for key, value in sorted(metrics['counts'].items()):
+        add(key, f'Number of {key.replace("_", " ")} in the last sync', [({}, value)])
+
+    repos = sorted(metrics['repos'].items())
+    add('repo_seconds', 'Time spent on a repository per phase in the last sync',
+        [({'repo': r, 'phase': n}, v) for r, m in repos for n, v in m['seconds'].items()])
+    for key in sorted({k for r, m in repos for k in m if k != 'seconds'}):
+        add(f'repo_{key}', f'Number of {key.replace("_", " ")} per repository in the last sync',
+            [({'repo': r}, m[key]) for r, m in repos if key in m])
+    return '\n'.join(lines) + '\n'
+
+
+def write_metrics(json_path=None, prometheus_path=None):
+    # Registered to run at exit, so failed runs are reported as well. Both
+    # files are replaced atomically, as collectors may read them at any time
+    metrics = get_metrics()
+    for path, content in ((json_path, json.dumps(metrics, indent=2) + '\n'),
+                          (prometheus_path, format_prometheus(metrics))):
+        if path is None:
+            continue
+        try:
+            with atomic_write(path) as fh:
+                fh.write(content)
+        except OSError as e:
+            print(f'Failed to write metrics to {path}: {e}', file=sys.stderr)
+
+# ################################# PROFILE ################################## #
+
+
+def start_profile():
+    # Profile the CPU time of the current thread and record the allocations
+    # until stop_profile(). Only used while everything runs one by one
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    profile = cProfile.Profile()
+    profile.enable()
+    return profile, snapshot, maxrss
+
+
+def stop_profile(name, started):
+    # Add the run to the profile of its phase. Of the allocations, only those
+    # still held at the end of the run are kept, grouped by source line.
+    # tracemalloc does not see memory of C libraries like libxml2, so the
+    # growth of the process' maximum resident set size is kept as well
+    profile, before, maxrss = started
+    profile.disable()
+    peak = tracemalloc.get_traced_memory()[1]
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - maxrss
+    after = tracemalloc.take_snapshot()
+    ignore = [tracemalloc.Filter(False, m.__file__) for m in (tracemalloc, cProfile, pstats)]
+    ignore.append(tracemalloc.Filter(False, '<frozen importlib._bootstrap>'))
+    diff = after.filter_traces(ignore).compare_to(before.filter_traces(ignore), 'lineno')
+
+    phase = _PROFILES.setdefault(name, {'stats': None, 'runs': 0, 'peak': 0,
+                                        'maxrss': 0, 'sites': {}})
+    if phase['stats'] is None:
+        phase['stats'] = pstats.Stats(profile)
+    else:
+        phase['stats'].add(profile)
+    phase['runs'] += 1
+    phase['peak'] = max(phase['peak'], peak)
+    phase['maxrss'] += maxrss
+    for d in diff:
+        if d.size_diff == 0:
+            continue
+        size, count = phase['sites'].get(d.traceback, (0, 0))
+        phase['sites'][d.traceback] = (size + d.size_diff, count + d.count_diff)
+
+
+def write_profiles(profile_dir):
+    # Write <phase>.pstats (e.g. for "python -m pstats" or snakeviz) and a
+    # <phase>.memory.txt report for every profiled phase
+    os.makedirs(profile_dir, exist_ok=True)
+    for name, phase in _PROFILES.items():
+        phase['stats'].dump_stats(os.path.join(profile_dir, f'{name}.pstats'))
+        sites = sorted(phase['sites'].items(), key=lambda s: abs(s[1][0]), reverse=True)
+        with open(os.path.join(profile_dir, f'{name}.memory.txt'), 'w') as fh:
+            # ru_maxrss is in KiB on Linux
+            print(f"{name}: {phase['runs']} runs, "
+                  f"peak {phase['peak'] / 1024 / 1024:.1f} MiB traced, "
+                  f"maximum resident set size grew by {phase['maxrss'] / 1024:.1f} MiB",
+                  file=fh)
+            print(f'\nTop {_PROFILE_TOP} source lines by memory allocated and still held '
+                  'at the end of the runs:', file=fh)
+            for traceback, (size, count) in sites[:_PROFILE_TOP]:
+                print(f'\n{size / 1024:+.1f} KiB in {count:+d} blocks', file=fh)
+                for line in traceback.format():
+                    print(line, file=fh)
+    print(f'\nProfiles written to {profile_dir}')
+
+# ############################# SPARSE CHECKOUT ############################## #
+
+
+def get_sparse_dirs(branch):
+    # The directories the sync reads or writes in every project of the branch,
+    # relative to the project: those of the sources and of all translations
+    resolver = branch['resolver']
+    projects = {}
+    for source, targets in sorted(branch['config_index'].items()):
+        for path in (source, *targets):
+            project_path, project = resolve_project(resolver, path)
+            if project_path is None:
+                continue
+            d = os.path.dirname(os.path.relpath(path, project_path))
+            # Files in the project root are part of every sparse checkout
+            if d:
+                projects.setdefault(project_path, set()).add(d)
+    return projects
+
+
+def get_sparse_checkout(repo):
+    # The directories of the repository's sparse checkout, None if it has none
+    try:
+        return repo.git.sparse_checkout('list').splitlines()
+    except git.GitCommandError:
+        return None
+
+
+def sparse_checkout(mode, branches):
+    # Print, apply or verify sparse checkouts (in cone mode) which hold only
+    # what the sync needs of every project of the given branches. Verifying
+    # fails for projects which are checked out fully or miss directories.
+    # Returns the exit code
+    failed = 0
+    count = 0
+    for branch in branches:
+        for project_path, dirs in sorted(get_sparse_dirs(branch).items()):
+            dirs = sorted(dirs)
+            path = os.path.join(branch['base_path'], project_path)
+            if mode == 'print':
+                print(f'{path}:')
+                for d in dirs:
+                    print(f'  {d}')
+                continue
+
+            if not os.path.exists(os.path.join(path, '.git')):
+                print(f'{path}: Not a git repository, skipping')
+                continue
+            count += 1
+            repo = open_repo(path)
+            if mode == 'apply':
+                try:
+                    with tempfile.TemporaryFile() as fh:
+                        fh.write('\n'.join(dirs).encode())
+                        fh.seek(0)
+                        repo.git.sparse_checkout('set', '--cone', '--stdin', istream=fh)
+                    print(f'{path}: {len(dirs)} directories')
+                except git.GitCommandError as e:
+                    print(f'{path}: Failed: {e.stderr.strip()}', file=sys.stderr)
+                    failed += 1
+                continue
+
+            current = get_sparse_checkout(repo)
+            if current is None:
+                print(f'{path}: Full checkout')
+                failed += 1
+                continue
+            missing = [d for d in dirs if not any(d == c or d.startswith(c + '/') for c in current)]
+            if missing:
+                print(f'{path}: Missing {" ".join(missing)}')
+                failed += 1
+
+    if mode == 'verify':
+        print(f'\n{count - failed} of {count} projects have the sparse checkout of the config')
+    elif mode == 'apply':
+        print(f'\nApplied the sparse checkout to {count - failed} of {count} projects')
+    return 1 if failed else 0
+
 # ############################################################################ #
 
 
@@ -362,7 +1893,8 @@ def parse_args():
         description="Synchronising AICP translations with Crowdin")
     sync = parser.add_mutually_exclusive_group()
     parser.add_argument('--username', help='Gerrit username')
-    parser.add_argument('--branch', help='AICP branch', required=True)
+    parser.add_argument('--branch', nargs='+', required=True,
+                        help='AICP branch, several branches are synced together')
     parser.add_argument('-c', '--config', help='Custom yaml config')
     parser.add_argument('--upload-sources', action='store_true',
                         help='Upload sources to AICP Crowdin')
@@ -376,6 +1908,65 @@ def parse_args():
                         help='Auto-Merge open AICP translations on Gerrit')
     parser.add_argument('-o', '--owner',
                         help='Specify the owner of the commits to submit')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of repositories to commit concurrently')
+    parser.add_argument('--submit-jobs', type=int, default=4,
+                        help='Number of changes to submit concurrently')
+    parser.add_argument('--push-jobs', type=int, default=2,
+                        help='Maximum number of concurrent pushes to Gerrit')
+    parser.add_argument('--clean-jobs', type=int, default=os.cpu_count() or 1,
+                        help='Number of processes cleaning downloaded translation files')
+    parser.add_argument('--backend', choices=('cli', 'api'), default='cli',
+                        help='Talk to Crowdin through the crowdin CLI or its API')
+    parser.add_argument('--api-jobs', type=int, default=8,
+                        help='Number of concurrent Crowdin API requests')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only download translations changed since the last '
+                             'incremental download (API backend only)')
+    parser.add_argument('--cache-dir', default=f'{_DIR}/.cache',
+                        help='Directory of the downloaded translations cache and '
+                             'the hashes of uploaded sources')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='Do not use the downloaded translations cache and upload '
+                             'all sources, changed or not')
+    parser.add_argument('--metrics', metavar='FILE',
+                        help='Write timings and counts of all phases and repositories '
+                             'as JSON to FILE at exit')
+    parser.add_argument('--metrics-prometheus', metavar='FILE',
+                        help='Write the metrics for the Prometheus textfile collector '
+                             'to FILE at exit')
+    parser.add_argument('--daemon', action='store_true',
+                        help='Keep running and repeat the requested actions every '
+                             '--interval seconds, uploading changed sources right away')
+    parser.add_argument('--interval', type=int, default=3600,
+                        help='Seconds between the sync cycles of the daemon')
+    parser.add_argument('--watch-interval', type=int, default=10,
+                        help='Seconds between checking the sources for changes in the daemon')
+    parser.add_argument('--status-port', type=int,
+                        help='Serve the status of the daemon as JSON on this local port')
+    parser.add_argument('--profile', metavar='DIR',
+                        help='Profile CPU time and memory allocations of every phase '
+                             'into DIR, running everything one by one')
+    parser.add_argument('--sparse-checkout', choices=('print', 'apply', 'verify'),
+                        help='Print, apply or verify sparse checkouts of all projects '
+                             'holding only the directories of the config, instead of syncing')
+    parser.add_argument('--cold-interval', type=int, default=1, metavar='N',
+                        help='Only sync languages changing less than --active-threshold '
+                             'strings per run every N runs, all others every run')
+    parser.add_argument('--active-threshold', type=float, default=1.0,
+                        help='Strings changed per run, on average, from which a language '
+                             'syncs every run')
+    parser.add_argument('--all-languages', action='store_true',
+                        help='Sync all languages in this run, whatever --cold-interval')
+    parser.add_argument('--shard', type=parse_shard, metavar='I/N',
+                        help='Only clean, commit and push the I-th of N disjoint parts '
+                             'of the projects (I from 1 to N)')
+    parser.add_argument('--result', metavar='FILE',
+                        help='Write the outcome of this run as JSON to FILE, to be '
+                             'combined with --merge-results')
+    parser.add_argument('--merge-results', nargs='+', metavar='FILE',
+                        help='Combine the --result files of all shards into one summary '
+                             'and exit code, instead of syncing')
     return parser.parse_args()
 
 # ################################# PREPARE ################################## #
@@ -408,24 +1999,369 @@ def check_files(files):
             return False
     return True
 
+# ################################## DAEMON ################################## #
+
+
+class StatusHandler(BaseHTTPRequestHandler):
+    # Serves the status of the daemon as JSON
+
+    def do_GET(self):
+        if self.path not in ('/', '/status'):
+            self.send_error(404)
+            return
+        body = json.dumps(get_daemon_status(self.server.status), indent=2).encode() + b'\n'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Keep the log of the syncs readable
+        pass
+
+
+def start_status_server(status, port):
+    # Only reachable from the local machine
+    server = ThreadingHTTPServer(('127.0.0.1', port), StatusHandler)
+    server.status = status
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f'Serving the status on http://127.0.0.1:{server.server_port}/status')
+    return server
+
+
+def get_daemon_status(status):
+    with status['lock']:
+        return json.loads(json.dumps(status['data']))
+
+
+def update_daemon_status(status, **kwargs):
+    with status['lock']:
+        status['data'].update(kwargs)
+
+
+def run_daemon_task(args, status, kind, task):
+    # Run a sync cycle or a source upload. Failures are recorded in the status
+    # instead of ending the daemon. Metrics are written and reset per task
+    start = time.time()
+    update_daemon_status(status, state=kind, running_since=start)
+    result = {'start': start, 'commits': False, 'error': None}
+    try:
+        result['commits'] = bool(task())
+    except SystemExit as e:
+        result['error'] = f'exit code {e.code}'
+    except Exception as e:
+        print(f'\nFailed: {e}', file=sys.stderr)
+        result['error'] = str(e)
+    result['end'] = time.time()
+    result['seconds'] = round(result['end'] - start, 3)
+    result['metrics'] = get_metrics()
+    if args.metrics or args.metrics_prometheus:
+        write_metrics(args.metrics, args.metrics_prometheus)
+    reset_metrics()
+
+    with status['lock']:
+        data = status['data']
+        data['state'] = 'idle'
+        data['running_since'] = None
+        data[f'{kind}s'] = data.get(f'{kind}s', 0) + 1
+        data[f'last_{kind}'] = result
+    return result
+
+
+def get_source_states(branch):
+    # Modification time and size of every source file of the branch
+    states = {}
+    for source in branch['config_index']:
+        try:
+            st = os.stat(os.path.join(branch['base_path'], source))
+            states[source] = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            states[source] = None
+    return states
+
+
+def upload_changed_sources(args, project_id, branch, sources):
+    with metrics_phase('upload'):
+        upload_branch_sources(project_id, branch, args.config, sources)
+
+
+def run_daemon(args, project_id, branches):
+    # Run all requested actions every --interval seconds, keeping manifests,
+    # configs, caches and repositories loaded in between. Sources are checked
+    # for changes every --watch-interval seconds and uploaded right away,
+    # so after the first cycle, cycles don't upload sources anymore
+    status = {'lock': threading.Lock(), 'data': {
+        'pid': os.getpid(),
+        'started': time.time(),
+        'branches': [b['name'] for b in branches] or args.branch,
+        'state': 'idle',
+        'next_cycle': time.time(),
+    }}
+    if args.status_port is not None:
+        start_status_server(status, args.status_port)
+
+    sources = {b['name']: get_source_states(b) for b in branches}
+    first = True
+    while True:
+        if time.time() >= status['data']['next_cycle']:
+            print(f'\nStarting a sync cycle at {time.strftime("%Y-%m-%d %H:%M:%S")}')
+            run_daemon_task(args, status, 'cycle',
+                            lambda: run_cycle(args, project_id, branches, first))
+            first = False
+            update_daemon_status(status, next_cycle=time.time() + args.interval)
+        elif args.upload_sources:
+            for b in branches:
+                states = get_source_states(b)
+                changed = sorted(s for s, st in states.items()
+                                 if st is not None and st != sources[b['name']].get(s))
+                if not changed:
+                    continue
+                print(f'\nChanged sources of {b["name"]}: {len(changed)}')
+                result = run_daemon_task(args, status, 'upload', lambda: upload_changed_sources(
+                    args, project_id, b, changed))
+                # Failed uploads are retried with the next check
+                if result['error'] is None:
+                    sources[b['name']] = states
+        time.sleep(max(0, min(args.watch_interval, status['data']['next_cycle'] - time.time())))
+
+# ################################## SHARDS ################################## #
+
+
+def parse_shard(value):
+    # "I/N" with I counted from 1, as index from 0 and count
+    m = re.fullmatch(r'(\d+)/(\d+)', value)
+    if m is None or not 0 < int(m.group(1)) <= int(m.group(2)):
+        raise argparse.ArgumentTypeError(f'{value} is not like 1/4')
+    return int(m.group(1)) - 1, int(m.group(2))
+
+
+def in_shard(shard, project_path):
+    # Projects are assigned by a stable hash of their path, so every machine
+    # agrees on the parts without talking to the others
+    if shard is None:
+        return True
+    index, count = shard
+    return int(hashlib.sha1(project_path.encode()).hexdigest(), 16) % count == index
+
+
+def write_result(path, branches, shard, commits_created):
+    # The outcome of one (sharded) run; failed runs don't write one, so they
+    # are noticed as missing when merging
+    result = {
+        'branch': branches,
+        'shard': list(shard) if shard is not None else None,
+        'commits_created': commits_created,
+        'counts': get_metrics()['counts'],
+    }
+    with atomic_write(path) as fh:
+        json.dump(result, fh, indent=2)
+        fh.write('\n')
+
+
+def merge_results(result_files, branches):
+    # Combine the results of all shards of a run. Returns the exit code of an
+    # unsharded run: 0 if commits were created, 2 if not, and 1 if shards are
+    # missing or don't belong together
+    results = []
+    for f in result_files:
+        try:
+            with open(f, 'r') as fh:
+                results.append(json.load(fh))
+        except (OSError, ValueError) as e:
+            print(f'Could not read {f}: {e}', file=sys.stderr)
+            return 1
+
+    shards = [tuple(r['shard']) if r['shard'] is not None else (0, 1) for r in results]
+    count = shards[0][1]
+    if any(r['branch'] != branches for r in results):
+        print(f'Results are not all of branch {" ".join(branches)}', file=sys.stderr)
+        return 1
+    if sorted(shards) != [(i, count) for i in range(count)]:
+        missing = sorted({i + 1 for i in range(count)} - {i + 1 for i, n in shards if n == count})
+        print(f'Results are not of all {count} shards, missing: '
+              f'{" ".join(map(str, missing)) or "none, but some twice"}', file=sys.stderr)
+        return 1
+
+    counts = {}
+    for r in results:
+        for key, n in r['counts'].items():
+            counts[key] = counts.get(key, 0) + n
+    print(f'Merged the results of {count} shards')
+    for key in sorted(counts):
+        print(f'{key}: {counts[key]}')
+    return 0 if any(r['commits_created'] for r in results) else 2
+
+# ################################ LANGUAGES ################################# #
+
+
+def load_language_index(config):
+    # The Crowdin language of every translation path of the config, relative
+    # to the base path
+    index = {}
+    for tf in config:
+        for lang, code in tf['languages_mapping']['android_code'].items():
+            index[get_target_path(tf['translation'], tf['source'], code, '')] = lang
+    return index
+
+
+def is_deferred(branch, path):
+    # Whether the translation path, relative to the base path, belongs to a
+    # language which isn't synced in this run
+    return bool(branch['deferred']) and branch['language_index'].get(path) in branch['deferred']
+
+
+def get_scheduled_target_paths(branch, project_path):
+    # The translation paths of the project synced in this run, relative to
+    # the project root
+    return frozenset(f for f in get_project_target_paths(branch['project_targets'], project_path)
+                     if not is_deferred(branch, f'{project_path}/{f}'))
+
+
+def load_language_state(cache_dir, branch):
+    # The change rates of all languages of the branch and the run they were
+    # last synced in. Without it, every language counts as active
+    state = {'path': os.path.join(cache_dir, f'{branch}_languages.json'),
+             'run': 0, 'languages': {}}
+    try:
+        with open(state['path'], 'r') as fh:
+            data = json.load(fh)
+        state['run'] = data['run']
+        state['languages'] = data['languages']
+    except (OSError, ValueError, KeyError):
+        pass
+    return state
+
+
+def save_language_state(state):
+    os.makedirs(os.path.dirname(state['path']), exist_ok=True)
+    with atomic_write(state['path']) as fh:
+        json.dump({'run': state['run'], 'languages': state['languages']}, fh,
+                  indent=1, sort_keys=True)
+
+
+def schedule_languages(state, languages, cold_interval, threshold):
+    # The languages to skip in the next run: those changing less than
+    # threshold strings per run, unless they weren't synced for cold_interval
+    # runs. Languages without a history are active
+    run = state['run'] + 1
+    deferred = set()
+    for lang in languages:
+        record = state['languages'].get(lang)
+        if record is None or record['strings'] >= threshold:
+            continue
+        if run - record['last_sync'] >= cold_interval:
+            continue
+        deferred.add(lang)
+    return deferred
+
+
+def update_language_state(state, languages, deferred, changes):
+    # Record the files and strings changed in this run for every synced
+    # language, given as a dict of language -> (files, strings). The rates
+    # are weighted averages per run; the changes of deferred languages pile
+    # up until they are synced, so they are spread over the skipped runs
+    state['run'] += 1
+    run = state['run']
+    for lang in sorted(set(languages) - set(deferred)):
+        files, strings = changes.get(lang, (0, 0))
+        record = state['languages'].get(lang)
+        if record is None:
+            state['languages'][lang] = {'files': files, 'strings': strings,
+                                        'last_sync': run, 'syncs': 1}
+            continue
+        runs = run - record['last_sync']
+        for key, count in (('files', files), ('strings', strings)):
+            rate = record[key] * (1 - _LANGUAGE_RATE_WEIGHT) + count / runs * _LANGUAGE_RATE_WEIGHT
+            record[key] = round(rate, 3)
+        record['last_sync'] = run
+        record['syncs'] += 1
+
+
+def get_language_changes(branch, results):
+    # The files and strings changed per language by the pushed commits of the
+    # branch, from the (push_as_commit arguments, result, changes) of a sync.
+    # Files whose strings couldn't be counted count as one string
+    changes = {}
+    for c, result, files in results:
+        if c[1] != branch['base_path'] or not result:
+            continue
+        for f, strings in files.items():
+            lang = branch['language_index'].get(f'{c[2]}/{f}')
+            if lang is None:
+                continue
+            n = changes.get(lang, (0, 0))
+            changes[lang] = (n[0] + 1, n[1] + (1 if strings is None else strings))
+    return changes
+
+
+def get_deferred_languages(args, branch):
+    # The cold languages skipped in this run of the branch, none on a full
+    # sweep or without a language history
+    if branch['languages'] is None or args.all_languages or args.cold_interval <= 1:
+        return set()
+    deferred = schedule_languages(branch['languages'], set(branch['language_index'].values()),
+                                  args.cold_interval, args.active_threshold)
+    if deferred:
+        print(f'\nDeferring {len(deferred)} cold languages of {branch["name"]}: '
+              f'{", ".join(sorted(deferred))}')
+        metrics_count('languages_deferred', len(deferred))
+    return deferred
+
 # ################################### MAIN ################################### #
 
 
-def upload_sources_crowdin(project_id, branch, config):
+def upload_sources_crowdin(project_id, branch, config, base_path=None, api=None, sources=None):
+    # Upload all sources or only the given ones, for the CLI through a copy
+    # of the config with just their entries. Returns the uploaded sources
+    if api is not None:
+        print('\nUploading sources to Crowdin (API)')
+        return upload_sources_api(api, project_id, base_path, branch, sources)
+
     if config:
         print('\nUploading sources to Crowdin (custom config)')
-        check_run(['crowdin', 'upload', 'sources',
-                   f'--project-id={project_id}',
-                   f'--branch={branch}',
-                   '--auto-update',
-                   f'--config={_DIR}/config/{config}'])
+        config_file = f'{_DIR}/config/{config}'
     else:
         print('\nUploading sources to Crowdin (AOSP supported languages)')
+        config_file = f'{_DIR}/config/{branch}.yml'
+    with tempfile.NamedTemporaryFile('w', suffix='.yml') as fh:
+        if sources is not None:
+            write_partial_config(config_file, sources, fh)
+            config_file = fh.name
         check_run(['crowdin', 'upload', 'sources',
                    f'--project-id={project_id}',
                    f'--branch={branch}',
                    '--auto-update',
-                   f'--config={_DIR}/config/{branch}.yml'])
+                   f'--config={config_file}'])
+    if sources is None:
+        sources = {tf['source'].lstrip('/') for tf in load_config([config_file])}
+    return set(sources)
+
+
+def upload_branch_sources(project_id, branch, config, sources=None):
+    # Upload the sources of a branch, or only the given ones, which changed
+    # since their last successful upload. Without a source state (--no-cache),
+    # all of them are uploaded
+    source_state = branch['source_state']
+    if source_state is None:
+        upload_sources_crowdin(project_id, branch['name'], config,
+                               branch['base_path'], branch['api'], sources)
+        return
+
+    hashes = get_source_hashes(branch['base_path'], branch['config'], sources)
+    changed = sorted(s for s, h in hashes.items() if source_state['sources'].get(s) != h)
+    metrics_count('sources_skipped', len(hashes) - len(changed))
+    if not changed:
+        print(f'\nSources of {branch["name"]} unchanged since their last upload, skipping')
+        return
+
+    print(f'\n{len(changed)} of {len(hashes)} sources of {branch["name"]} changed')
+    uploaded = upload_sources_crowdin(project_id, branch['name'], config,
+                                      branch['base_path'], branch['api'], changed)
+    metrics_count('sources_uploaded', len(uploaded))
+    for source in uploaded:
+        source_state['sources'][source] = hashes[source]
+    save_source_state(source_state)
 
 
 def upload_translations_crowdin(project_id, branch, config):
@@ -448,146 +2384,150 @@ def upload_translations_crowdin(project_id, branch, config):
                    f'--config={_DIR}/config/{branch}.yml'])
 
 
-def local_download(project_id, base_path, branch, xml, config):
-    if config:
+def download_branch(project_id, branch, config, arrived=None):
+    # Download the translations of one branch. On incremental downloads,
+    # returns the set of changed translation paths, otherwise None, and
+    # reports every changed path to the optional arrived(path) once it is
+    # written
+    phase = metrics_start('download')
+    changed = None
+    deferred = branch['deferred']
+    # The crowdin CLI downloads all languages, unless some are given
+    languages = [f'--language={l}' for l in sorted(set(branch['language_index'].values()))
+                 if l not in deferred] if deferred else []
+    if branch['sync_state'] is not None:
+        print('\nDownloading changed translations from Crowdin (API)')
+        changed = download_incremental_api(branch['api'], project_id, branch['base_path'],
+                                           branch['name'], branch['sync_state'], deferred,
+                                           arrived)
+    elif branch['api'] is not None:
+        print('\nDownloading translations from Crowdin (API)')
+        download_api(branch['api'], project_id, branch['base_path'], branch['name'], deferred)
+    elif config:
         print('\nDownloading translations from Crowdin (custom config)')
         check_run(['crowdin', 'download',
                    f'--project-id={project_id}',
-                   f'--branch={branch}',
+                   f'--branch={branch["name"]}',
                    '--skip-untranslated-strings',
                    '--export-only-approved',
-                   f'--config={_DIR}/config/{config}'])
+                   f'--config={_DIR}/config/{config}'] + languages)
     else:
         print('\nDownloading translations from Crowdin '
               '(AOSP supported languages)')
         check_run(['crowdin', 'download',
                    f'--project-id={project_id}',
-                   f'--branch={branch}',
+                   f'--branch={branch["name"]}',
                    '--skip-untranslated-strings',
                    '--export-only-approved',
-                   f'--config={_DIR}/config/{branch}.yml'])
-
-    print('\nRemoving useless empty translation files (AOSP supported languages)')
-    empty_contents = {
-        '<resources/>',
-        '<resources xmlns:xliff="urn:oasis:names:tc:xliff:document:1.2"/>',
-        ('<resources xmlns:android='
-         '"http://schemas.android.com/apk/res/android"/>'),
-        ('<resources xmlns:android="http://schemas.android.com/apk/res/android"'
-         ' xmlns:xliff="urn:oasis:names:tc:xliff:document:1.2"/>'),
-        ('<resources xmlns:tools="http://schemas.android.com/tools"'
-         ' xmlns:xliff="urn:oasis:names:tc:xliff:document:1.2"/>'),
-        ('<resources xmlns:xliff="urn:oasis:names:tc:xliff:document:1.2">\n</resources>'),
-        ('<resources xmlns:android='
-         '"http://schemas.android.com/apk/res/android">\n</resources>'),
-        ('<resources xmlns:android="http://schemas.android.com/apk/res/android"'
-         ' xmlns:xliff="urn:oasis:names:tc:xliff:document:1.2">\n</resources>'),
-        ('<resources xmlns:tools="http://schemas.android.com/tools"'
-         ' xmlns:xliff="urn:oasis:names:tc:xliff:document:1.2">\n</resources>'),
-        ('<resources>\n</resources>')
-    }
-
-    xf = None
-    cmd = ['crowdin', 'list', 'translations',
-           f'--project-id={project_id}',
-           '--plain',
-           f'--config={_DIR}/config/{branch}.yml']
-    comm, ret = run_subprocess(cmd)
-    if ret != 0:
-        sys.exit(ret)
-    # Split in list and remove last empty entry
-    xml_list=str(comm[0]).split("\n")[:-1]
-    for xml_file in xml_list:
-        try:
-            print("Checking: " + base_path + '/' + xml_file)
-            tree = etree.XML(open(base_path + '/' + xml_file).read().encode())
-            etree.strip_tags(tree,etree.Comment)
-            treestring = etree.tostring(tree,encoding='UTF-8')
-            xf = "".join([s for s in treestring.decode().strip().splitlines(True) if s.strip()])
-            for line in empty_contents:
-                if line in xf:
-                    print("Removing: " + base_path + '/' + xml_file)
-                    os.remove(base_path + '/' + xml_file)
-                    break
-        except IOError:
-            print("File not found: " + xml_file)
-            sys.exit(1)
-        except etree.XMLSyntaxError:
-            print("XML Syntax error in file: " + xml_file)
-            sys.exit(1)
-    del xf
-
+                   f'--config={_DIR}/config/{branch["name"]}.yml'] + languages)
+    metrics_end(phase)
+    return changed
+
+
+def get_branch_entries(branch, changed=None, shard=None):
+    # The (base_path, project_path, filename) entries of every translation
+    # path the config can produce, or only of the changed ones, in the given
+    # shard and of the languages synced in this run. Only those Crowdin
+    # actually exported exist on disk
+    entries = []
+    for t in sorted(t for targets in branch['config_index'].values() for t in targets):
+        if changed is not None and t not in changed:
+            continue
+        entry = get_branch_entry(branch, t, shard)
+        if entry is not None:
+            entries.append(entry)
+    return entries
 
-def download_crowdin(project_id, base_path, branch, xml, username, config):
-    local_download(project_id, base_path, branch, xml, config)
 
-    print('\nCreating a list of pushable translations')
-    # Get all files that Crowdin pushed
-    paths = []
-    if config:
-        files = [f'{_DIR}/config/{config}']
+def get_branch_entry(branch, path, shard=None):
+    # The (base_path, project_path, filename) entry of a translation path,
+    # relative to the base path, or None if it is deferred or in another shard
+    if is_deferred(branch, path):
+        return None
+    project_path, project = resolve_project(branch['resolver'], path)
+    if project_path is None:
+        project_path = os.path.dirname(path)
+    if not in_shard(shard, project_path):
+        return None
+    return branch['base_path'], project_path, os.path.relpath(path, project_path)
+
+
+def local_download(project_id, branches, config, clean_jobs=1, shard=None):
+    # Download and clean the translations of all given branches, cleaning only
+    # the projects of the given shard. Returns a dict of file path -> hash of
+    # the cleaned file (None if removed).
+    # On incremental downloads, it only holds the changed files.
+    # Branches whose download fails are left out
+    # While profiling, the branches are downloaded one after the other in
+    # the main thread
+    if len(branches) == 1 or _PROFILE_DIR is not None:
+        futures = [run_inline(download_branch, project_id, b, config) for b in branches]
     else:
-        files = [f'{_DIR}/config/{branch}.yml']
-    for c in files:
-        cmd = ['crowdin', 'list', 'sources',
-               f'--branch={branch}', f'--config={c}', '--plain']
-        comm, ret = run_subprocess(cmd)
-        if ret != 0:
-            sys.exit(ret)
-        for p in str(comm[0]).split("\n"):
-            paths.append(p.replace(f'/{branch}', ''))
-
-    print('\nUploading translations to AICP Gerrit')
-    items = [x for xmlfile in xml for x in xmlfile.findall("//project")]
-    all_projects = []
+        # Downloading is mostly waiting for Crowdin, so all branches wait at once
+        with ThreadPoolExecutor(max_workers=len(branches)) as executor:
+            futures = [executor.submit(download_branch, project_id, b, config)
+                       for b in branches]
+    downloaded = []
+    for branch, future in zip(branches, futures):
+        try:
+            downloaded.append((branch, future.result()))
+        except (Exception, SystemExit) as e:
+            print(f'\nFailed to download {branch["name"]}: {describe_error(e)}',
+                  file=sys.stderr)
+            _BRANCHES_FAILED.append(branch['name'])
+
+    # Parse every downloaded file once to remove useless empty translation
+    # files as well as comments and strings without 'product=default'.
+    # The files of all branches are cleaned by one pool of processes
+    print('\nCleaning translation files (AOSP supported languages)')
+    with metrics_phase('resolve'):
+        entries = []
+        for branch, branch_changed in downloaded:
+            entries += get_branch_entries(branch, branch_changed, shard)
+
+    caches = {b['base_path']: b['cache'] for b in branches if b['cache'] is not None}
+    with metrics_phase('clean'):
+        counts, hashes = clean_xml_files(entries, clean_jobs, caches)
+    print(f"\nCleaned {counts.get(_CLEAN_CLEANED, 0)}, "
+          f"removed {counts.get(_CLEAN_REMOVED, 0)}, "
+          f"reset {counts.get(_CLEAN_RESET, 0)}, "
+          f"failed {counts.get(_CLEAN_FAILED, 0)} files")
+    return hashes
+
+
+def get_branch_commits(branch, username, shard=None):
+    # The arguments of push_as_commit for every project of the branch and the
+    # given shard
+    base_path = branch['base_path']
+    config_index = branch['config_index']
+    # All source files of the config, as Crowdin would list them
+    paths = sorted(config_index)
+
+    phase = metrics_start('resolve')
+    resolver = branch['resolver']
+    all_projects = set()
+    commits = []
 
     for path in paths:
         path = path.strip()
         if not path:
             continue
 
-        if "/res" not in path:
-            print(f'WARNING: Cannot determine project root dir of [{path}], skipping.')
-            continue
-
-        # Usually the project root is everything before /res
-        # but there are special cases where /res is part of the repo name as well
-        parts = path.split("/res")
-        if len(parts) == 2:
-            result = parts[0]
-        elif len(parts) == 3:
-            result = parts[0] + '/res' + parts[1]
-        else:
-            print(f'WARNING: Splitting the path not successful for [{path}], skipping')
-            continue
-
-        result = result.strip('/')
-        if result == path.strip('/'):
-            print(f'WARNING: Cannot determine project root dir of [{path}], skipping.')
-            continue
-
-        if result in all_projects:
+        result = get_project_root(path)
+        if result is None:
             continue
 
         # When a project has multiple translatable files, Crowdin will
         # give duplicates.
         # We don't want that (useless empty commits), so we save each
         # project in all_projects and check if it's already in there.
-        all_projects.append(result)
+        if result in all_projects:
+            continue
+        all_projects.add(result)
 
         # Search AICP/platform_manifest/*.xml or
         # config/%(branch)_extra_packages.xml for the project's name
-        resultPath = None
-        resultProject = None
-        for project in items:
-            path = project.get('path')
-            if not (result + '/').startswith(path +'/'):
-                continue
-            # We want the longest match, so projects in subfolders of other projects are also
-            # taken into account
-            if resultPath is None or len(path) > len(resultPath):
-                resultPath = path
-                resultProject = project
+        resultPath, resultProject = resolve_project(resolver, result)
 
         # Just in case no project was found
         if resultPath is None:
@@ -597,37 +2537,301 @@ def download_crowdin(project_id, base_path, branch, xml, username, config):
             if resultPath in all_projects:
                 continue
             result = resultPath
-            all_projects.append(result)
+            all_projects.add(result)
 
-        br = resultProject.get('revision') or branch
+        if not in_shard(shard, result):
+            continue
 
-        push_as_commit(files, base_path, result,
-                       resultProject.get('name'), br, username)
+        br = resultProject.get('revision') or branch['name']
 
+        commits.append((branch['project_targets'], base_path, result,
+                        resultProject.get('name'), br, username))
+    metrics_end(phase)
+    return commits
 
-def sig_handler(signal_received, frame):
-    print('')
-    print('SIGINT or CTRL-C detected. Exiting gracefully')
-    exit(0)
 
+def is_commit_pending(branch, commit, hashes):
+    # Whether the project of the given push_as_commit arguments may have to be
+    # committed, after its files were cleaned
+    base_path = branch['base_path']
+    file_paths = get_scheduled_target_paths(branch, commit[2])
 
-def main():
-    global _COMMITS_CREATED
-    signal(SIGINT, sig_handler)
-    args = parse_args()
-    default_branch = args.branch
+    # On incremental downloads, only repositories with changed files are left
+    if branch['sync_state'] is not None:
+        return any(os.path.normpath(f'{base_path}/{commit[2]}/{f}') in hashes
+                   for f in file_paths)
 
-    if args.submit:
-        if args.username is None:
-            print('Argument -u/--username is required for submitting!')
-            sys.exit(1)
-        submit_gerrit(default_branch, args.username, args.owner)
-        sys.exit(0)
+    # Skip repositories which are exactly like after they were last staged
+    cache = branch['cache']
+    if cache is not None:
+        if cache['repos'].get(commit[2]) == get_repo_state(base_path, commit[2],
+                                                            file_paths, hashes):
+            print(f'\nCommitting {commit[3]} on branch {commit[4]}: Unchanged, skipping')
+            return False
+    return True
 
-    project_id_env = 'AICP_CROWDIN_PROJECT_ID'
-    project_id = os.getenv(project_id_env)
 
-    base_path_branch_suffix = default_branch.replace('.', '_')
+def describe_error(e):
+    # The downloads exit after printing why, only their exit code is left
+    if isinstance(e, SystemExit):
+        return f'exit code {e.code}'
+    return str(e)
+
+
+def run_inline(fn, *args):
+    # A finished future of fn(*args), for pipeline stages without workers
+    future = Future()
+    try:
+        future.set_result(fn(*args))
+    except (Exception, SystemExit) as e:
+        future.set_exception(e)
+    return future
+
+
+def sync_branches(branches, username, download, jobs=1, push_jobs=1, clean_jobs=1,
+                  shard=None):
+    # Download, clean, commit and push all given branches as a pipeline, with
+    # download(branch, arrived) downloading the translations of a branch. The
+    # files of a branch are cleaned as soon as its download finished, or as
+    # soon as the download reports them with arrived(path), and every
+    # repository is committed and pushed as soon as all of its files are
+    # cleaned, while other branches still download and other files are
+    # cleaned. Projects are resolved and open changes looked up while the
+    # downloads run. Workers only get as much work as they can start on, the
+    # rest waits in queues, so no stage runs far ahead of the next one.
+    # A branch whose download fails is left out, the others go on.
+    # Returns a list of (push_as_commit arguments, result, dict of committed
+    # file -> changed strings), a dict of clean result -> number of files,
+    # the hashes of the cleaned files and the names of the failed branches
+    clean = get_clean_state({b['base_path']: b['cache'] for b in branches
+                             if b['cache'] is not None})
+    by_base = {b['base_path']: b for b in branches}
+    # Downloading is mostly waiting for Crowdin, so all branches wait at once
+    # and everything else goes on meanwhile. While profiling, everything runs
+    # in the main thread
+    io_pool = None
+    if _PROFILE_DIR is None:
+        io_pool = ThreadPoolExecutor(max_workers=len(branches))
+    clean_pool = open_clean_pool(clean_jobs) if clean_jobs > 1 else None
+    commit_pool = ThreadPoolExecutor(max_workers=jobs) if jobs > 1 else None
+    push_lock = threading.BoundedSemaphore(max(push_jobs, 1))
+    limits = {'clean': max(clean_jobs, 1) * 2, 'commit': max(jobs, 1)}
+
+    running = {}
+    busy = {'download': 0, 'clean': 0, 'commit': 0}
+    clean_queue = collections.deque()
+    commit_queue = collections.deque()
+    # Commits by index, the cleaned files each one still waits for and the
+    # commits waiting for each file
+    commits = []
+    changes = []
+    waiting = {}
+    path_commits = {}
+    results = []
+    failed = []
+    # Files which are being cleaned or are done, and the files reported by
+    # downloads, which complete a future to wake up the loop
+    started = set()
+    finished = set()
+    arrivals = {'lock': threading.Lock(), 'paths': [], 'future': Future()}
+
+    def submit(pool, kind, payload, fn, *args):
+        future = run_inline(fn, *args) if pool is None else pool.submit(fn, *args)
+        running[future] = (kind, payload)
+        busy[kind] += 1
+
+    def ready(i):
+        branch = by_base[commits[i][1]]
+        if is_commit_pending(branch, commits[i], clean['hashes']):
+            commit_queue.append(i)
+
+    def done(path):
+        finished.add(path)
+        for i in path_commits.pop(path, ()):
+            waiting[i].discard(path)
+            if not waiting[i]:
+                ready(i)
+
+    def arrived(branch, path):
+        # Called by the download threads
+        with arrivals['lock']:
+            arrivals['paths'].append((branch, path))
+            if not arrivals['future'].done():
+                arrivals['future'].set_result(None)
+
+    def take_arrivals():
+        with arrivals['lock']:
+            paths = arrivals['paths']
+            arrivals['paths'] = []
+            arrivals['future'] = Future()
+        entries = []
+        for branch, path in paths:
+            entry = get_branch_entry(branch, path, shard)
+            if entry is not None and os.path.normpath('/'.join(entry)) not in started:
+                entries.append(entry)
+        queue_clean(entries)
+
+    def downloaded(branch, changed):
+        base_path = branch['base_path']
+        with metrics_phase('resolve'):
+            entries = get_branch_entries(branch, changed, shard)
+        paths = {os.path.normpath('/'.join(e)) for e in entries}
+        for i, c in enumerate(commits):
+            if c[1] != base_path:
+                continue
+            waiting[i] = {os.path.normpath(f'{base_path}/{c[2]}/{f}')
+                          for f in get_project_target_paths(c[0], c[2])} & paths
+            waiting[i] -= finished
+            for path in waiting[i]:
+                path_commits.setdefault(path, []).append(i)
+            if not waiting[i]:
+                ready(i)
+        queue_clean([e for e in entries if os.path.normpath('/'.join(e)) not in started])
+
+    def queue_clean(entries):
+        started.update(os.path.normpath('/'.join(e)) for e in entries)
+        with metrics_phase('clean'):
+            misses = clean_cached(clean, entries)
+        # Batches never span repositories, so each one can complete one
+        batch = []
+        for entry in misses:
+            if batch and (len(batch) == _CLEAN_BATCH or batch[-1][:2] != entry[:2]):
+                clean_queue.append(batch)
+                batch = []
+            batch.append(entry)
+        if batch:
+            clean_queue.append(batch)
+        paths = {os.path.normpath('/'.join(e)) for e in entries}
+        misses = {os.path.normpath('/'.join(e)) for e in misses}
+        for path in sorted(paths - misses):
+            done(path)
+
+    try:
+        for b in branches:
+            submit(io_pool, 'download', b, download, b,
+                   lambda path, b=b: arrived(b, path))
+
+        print('\nCreating a list of pushable translations')
+        for b in branches:
+            commits += get_branch_commits(b, username, shard)
+        changes = [{} for c in commits]
+        # Commits matching an open change are not pushed again
+        open_changes = get_open_changes(username, {c[4] for c in commits}) if commits else {}
+
+        print('\nCleaning translation files and uploading them to AICP Gerrit')
+        while running or clean_queue or commit_queue:
+            while clean_queue and busy['clean'] < limits['clean']:
+                batch = clean_queue.popleft()
+                if clean_pool is None:
+                    with metrics_phase('clean'):
+                        submit(None, 'clean', None, clean_xml_files_buffered, batch)
+                else:
+                    # The files are cleaned in other processes, this only
+                    # times how long the batch took
+                    submit(clean_pool, 'clean', ('clean', time.monotonic(), None),
+                           clean_xml_files_buffered, batch)
+            # The repositories of all branches share the workers and push slots
+            while commit_queue and busy['commit'] < limits['commit']:
+                i = commit_queue.popleft()
+                submit(commit_pool, 'commit', i, push_as_commit_buffered, push_lock, False,
+                       open_changes, changes[i], *commits[i])
+
+            arrival = arrivals['future']
+            completed, _ = wait([*running, arrival], return_when=FIRST_COMPLETED)
+            if arrival in completed:
+                completed.discard(arrival)
+                take_arrivals()
+            for future in completed:
+                kind, payload = running.pop(future)
+                busy[kind] -= 1
+                if kind == 'download':
+                    try:
+                        changed = future.result()
+                    except (Exception, SystemExit) as e:
+                        # Its repositories never get to wait for files, so
+                        # none of them is committed
+                        print(f'\nFailed to download {payload["name"]}: {describe_error(e)}',
+                              file=sys.stderr)
+                        failed.append(payload['name'])
+                        continue
+                    downloaded(payload, changed)
+                elif kind == 'clean':
+                    if payload is not None:
+                        metrics_end(payload)
+                    for entry, result, output, stats in future.result():
+                        finish_clean(clean, entry, result, output, stats)
+                        done(os.path.normpath('/'.join(entry)))
+                else:
+                    created, out, err = future.result()
+                    print(out, end='')
+                    print(err, end='', file=sys.stderr)
+                    results.append((commits[payload], created, changes[payload]))
+    finally:
+        for pool in (io_pool, clean_pool, commit_pool):
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+        for repo in clean['repos'].values():
+            repo.close()
+
+    # Files which failed to clean or whose repository failed to commit or
+    # push are exported again next time, Crowdin would report them unchanged
+    lost = set(clean['failed'])
+    for c, created, files in results:
+        if created is False:
+            lost.update(os.path.normpath(f'{c[1]}/{c[2]}/{f}')
+                        for f in get_project_target_paths(c[0], c[2]))
+    for b in branches:
+        if b['sync_state'] is not None and b['name'] not in failed:
+            forget_exports(b['sync_state'], b['base_path'], lost)
+
+    return results, clean['counts'], clean['hashes'], failed
+
+
+def download_crowdin(project_id, branches, username, config,
+                     jobs=1, push_jobs=1, clean_jobs=1, shard=None):
+    global _COMMITS_CREATED
+    counts = _METRICS['counts']
+    avoided = counts.get('commits_avoided', 0), counts.get('pushes_avoided', 0)
+    results, cleaned, hashes, failed = sync_branches(
+        branches, username, lambda b, arrived: download_branch(project_id, b, config, arrived),
+        jobs, push_jobs, clean_jobs, shard)
+    _BRANCHES_FAILED.extend(failed)
+
+    created = [r for c, r, f in results]
+    if any(created):
+        _COMMITS_CREATED = True
+    print(f"\nCleaned {cleaned.get(_CLEAN_CLEANED, 0)}, "
+          f"removed {cleaned.get(_CLEAN_REMOVED, 0)}, "
+          f"reset {cleaned.get(_CLEAN_RESET, 0)}, "
+          f"failed {cleaned.get(_CLEAN_FAILED, 0)} files")
+    print(f'Pushed {created.count(True)} commits, failed {created.count(False)}, '
+          f'avoided {counts.get("commits_avoided", 0) - avoided[0]} without string changes '
+          f'and {counts.get("pushes_avoided", 0) - avoided[1]} matching open changes')
+
+    for b in branches:
+        if b['languages'] is not None and b['name'] not in failed:
+            update_language_state(b['languages'], set(b['language_index'].values()),
+                                  b['deferred'], get_language_changes(b, results))
+
+    by_base = {b['base_path']: b for b in branches
+               if b['cache'] is not None and b['sync_state'] is None}
+    for c, result, files in results:
+        branch = by_base.get(c[1])
+        if branch is None:
+            continue
+        cache = branch['cache']
+        # Failed repositories have to be staged again next time
+        if result is False:
+            cache['repos'].pop(c[2], None)
+            continue
+        file_paths = get_scheduled_target_paths(branch, c[2])
+        cache['repos'][c[2]] = get_repo_state(c[1], c[2], file_paths, hashes)
+
+
+def load_branch(args, name, api, shared):
+    # Everything needed to sync one branch: its tree, manifests, config,
+    # cache and the states of incremental downloads and source uploads
+    base_path_branch_suffix = name.replace('.', '_')
     base_path_env = f'AICP_CROWDIN_BASE_PATH_{base_path_branch_suffix}'
     base_path = os.getenv(base_path_env)
     if base_path is None:
@@ -638,43 +2842,232 @@ def main():
         print(f'{base_path_env} is not a real directory: {base_path}')
         sys.exit(1)
 
-    if not check_dependencies():
-        sys.exit(1)
-
     xml_default = load_xml(x=f'{base_path}/platform_manifest/crowdin.xml')
     if xml_default is None:
         sys.exit(1)
 
-    xml_extra = load_xml(x=f'{_DIR}/config/{default_branch}_extra_packages.xml')
+    xml_extra = load_xml(x=f'{_DIR}/config/{name}_extra_packages.xml')
     if xml_extra is not None:
         xml_files = (xml_default, xml_extra)
     else:
-        xml_files = (xml_default)
+        xml_files = (xml_default,)
 
     if args.config:
         files = [f'{_DIR}/config/{args.config}']
     else:
-        files = [f'{_DIR}/config/{default_branch}.yml']
+        files = [f'{_DIR}/config/{name}.yml']
     if not check_files(files):
         sys.exit(1)
+    config = load_config(files)
+
+    cache = None
+    if (args.download or args.local_download) and not args.no_cache:
+        cache = load_cache(args.cache_dir, name, files)
+
+    sync_state = None
+    if args.incremental:
+        sync_state = load_sync_state(args.cache_dir, name)
+
+    source_state = None
+    if args.upload_sources and not args.no_cache:
+        source_state = load_source_state(args.cache_dir, name)
+
+    languages = None
+    if args.download and not args.no_cache:
+        languages = load_language_state(args.cache_dir, name)
+
+    config_index = load_config_index(config, shared)
+    resolver = load_project_resolver(xml_files)
+    return {
+        'name': name,
+        'base_path': base_path,
+        'xml': xml_files,
+        'config': config,
+        'config_index': config_index,
+        'resolver': resolver,
+        'project_targets': load_project_targets(config_index, resolver),
+        'api': dict(api, config=config) if api is not None else None,
+        'cache': cache,
+        'sync_state': sync_state,
+        'source_state': source_state,
+        'language_index': load_language_index(config),
+        'languages': languages,
+        'deferred': set(),
+    }
 
-    if args.download and args.username is None:
-        print('Argument --username is required to perform this action')
-        sys.exit(1)
 
-    if args.upload_sources:
-        upload_sources_crowdin(project_id, default_branch, args.config)
+def run_cycle(args, project_id, branches, upload_sources=True):
+    # Run all requested actions once. Returns whether commits were created,
+    # exits with 1 after all branches are done if any of them failed
+    global _COMMITS_CREATED
+    _COMMITS_CREATED = False
+    _BRANCHES_FAILED.clear()
+
+    if args.upload_sources and upload_sources:
+        for b in branches:
+            with metrics_phase('upload'):
+                upload_branch_sources(project_id, b, args.config)
 
     if args.upload_translations:
-        upload_translations_crowdin(project_id, default_branch, args.config)
+        for b in branches:
+            with metrics_phase('upload'):
+                upload_translations_crowdin(project_id, b['name'], args.config)
+
+    for b in branches:
+        b['deferred'] = get_deferred_languages(args, b)
 
     if args.local_download:
-        local_download(project_id, base_path, default_branch, xml_files, args.config)
+        local_download(project_id, branches, args.config, args.clean_jobs, args.shard)
 
     if args.download:
-        download_crowdin(project_id, base_path, default_branch, xml_files, args.username, args.config)
+        download_crowdin(project_id, branches, args.username, args.config,
+                         args.jobs, args.push_jobs, args.clean_jobs, args.shard)
+
+    for b in branches:
+        if b['cache'] is not None:
+            save_cache(b['cache'])
+        # Files of a failed incremental download may be on disk without
+        # being committed, so they have to be downloaded again
+        if b['sync_state'] is not None and b['name'] in _BRANCHES_FAILED:
+            b['sync_state'] = load_sync_state(os.path.dirname(b['sync_state']['path']),
+                                              b['name'])
+        elif b['sync_state'] is not None:
+            save_sync_state(b['sync_state'])
+        if b['languages'] is not None:
+            save_language_state(b['languages'])
+    if any(b['cache'] is not None for b in branches):
+        prune_cache_blobs(args.cache_dir)
 
-    if _COMMITS_CREATED:
+    if args.submit:
+        for name in args.branch:
+            with metrics_phase('submit'):
+                if not submit_gerrit(name, args.username, args.owner, args.submit_jobs):
+                    _BRANCHES_FAILED.append(name)
+
+    if _BRANCHES_FAILED:
+        print(f'\nFailed to sync branches: {", ".join(_BRANCHES_FAILED)}', file=sys.stderr)
+        sys.exit(1)
+    return _COMMITS_CREATED
+
+
+def sig_handler(signal_received, frame):
+    print('')
+    print('SIGINT or CTRL-C detected. Exiting gracefully')
+    exit(0)
+
+
+def daemon_sig_handler(signal_received, frame):
+    # Failing cycles are caught by the daemon, an interrupt is not
+    raise KeyboardInterrupt
+
+
+def main():
+    global _PROFILE_DIR
+    signal(SIGINT, sig_handler)
+    args = parse_args()
+
+    if args.merge_results:
+        sys.exit(merge_results(args.merge_results, args.branch))
+
+    # A result file left from an earlier run must not be taken for this one's
+    if args.result:
+        if args.daemon:
+            print('Argument --result can not be used with --daemon')
+            sys.exit(1)
+        if os.path.exists(args.result):
+            os.remove(args.result)
+
+    # The daemon writes the metrics of every cycle itself
+    _METRICS['branch'] = ','.join(args.branch)
+    if (args.metrics or args.metrics_prometheus) and not args.daemon:
+        atexit.register(write_metrics, args.metrics, args.metrics_prometheus)
+
+    # The CPU profiler only sees the thread it runs in, so repositories and
+    # translation files are processed in the main thread while profiling
+    if args.profile:
+        _PROFILE_DIR = args.profile
+        args.jobs = args.clean_jobs = 1
+        tracemalloc.start()
+        atexit.register(write_profiles, args.profile)
+
+    if args.submit:
+        if args.username is None:
+            print('Argument -u/--username is required for submitting!')
+            sys.exit(1)
+        if not args.daemon:
+            failed = []
+            for name in args.branch:
+                with metrics_phase('submit'):
+                    if not submit_gerrit(name, args.username, args.owner, args.submit_jobs):
+                        failed.append(name)
+            if failed:
+                print(f'\nFailed to query the open changes of: {", ".join(failed)}',
+                      file=sys.stderr)
+                sys.exit(1)
+            sys.exit(0)
+
+    if args.config and len(args.branch) > 1:
+        print('Argument --config can only be used with a single branch')
+        sys.exit(1)
+
+    # Neither Crowdin nor Gerrit are needed for that
+    if args.sparse_checkout:
+        shared = {}
+        branches = [load_branch(args, name, None, shared) for name in args.branch]
+        sys.exit(sparse_checkout(args.sparse_checkout, branches))
+
+    project_id_env = 'AICP_CROWDIN_PROJECT_ID'
+    project_id = os.getenv(project_id_env)
+
+    # The API backend needs the CLI only for uploading translations
+    if args.backend == 'cli' or args.upload_translations:
+        if not check_dependencies():
+            sys.exit(1)
+    if args.backend == 'api' and requests is None:
+        print('You have not installed python-requests, which the API backend needs.',
+              file=sys.stderr)
+        sys.exit(1)
+
+    if args.incremental and args.backend != 'api':
+        print('Argument --incremental requires --backend api')
+        sys.exit(1)
+
+    if args.download and args.username is None:
+        print('Argument --username is required to perform this action')
+        sys.exit(1)
+
+    # All branches share one connection pool to Crowdin and the expansions of
+    # their language mappings
+    api = None
+    if args.backend == 'api':
+        api = open_crowdin_api(None, args.api_jobs)
+    shared = {}
+    branches = []
+    if args.upload_sources or args.upload_translations or args.download or args.local_download:
+        branches = [load_branch(args, name, api, shared) for name in args.branch]
+
+    base_paths = [b['base_path'] for b in branches]
+    if len(set(base_paths)) != len(base_paths):
+        print('Every branch needs its own base path')
+        sys.exit(1)
+    # Tell the same repositories of different branches apart in the metrics
+    if len(branches) > 1:
+        for b in branches:
+            _METRICS['bases'][b['base_path']] = b['name']
+
+    if args.daemon:
+        signal(SIGINT, daemon_sig_handler)
+        signal(SIGTERM, daemon_sig_handler)
+        try:
+            run_daemon(args, project_id, branches)
+        except KeyboardInterrupt:
+            print('\nStopping the daemon')
+            sys.exit(0)
+
+    created = run_cycle(args, project_id, branches)
+    if args.result:
+        write_result(args.result, args.branch, args.shard, created)
+    if created:
         print('\nDone!')
         sys.exit(0)
     else:
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# test_changed_files.py
+#
+# Listing the translation files of a repository which have to be staged,
+# parsed from the NUL separated output of a single git status call.
+#
+#   python -m unittest discover tests
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import git
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import crowdin_sync  # noqa: E402
+
+
+class ChangedFilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.repo = git.Repo.init(self.path)
+        self.addCleanup(self.repo.close)
+        with self.repo.config_writer() as config:
+            config.set_value('user', 'name', 'Test')
+            config.set_value('user', 'email', 'test@localhost')
+        for path in ('res/values-de/strings.xml', 'res/values-fr/strings.xml',
+                     'res/values-it/strings.xml', 'other/values-de/strings.xml'):
+            self.write(path, 'old')
+        self.repo.git.add('-A')
+        self.repo.git.commit('-q', '-m', 'Initial commit')
+
+    def write(self, path, content):
+        os.makedirs(os.path.join(self.path, os.path.dirname(path)), exist_ok=True)
+        with open(os.path.join(self.path, path), 'w') as fh:
+            fh.write(content)
+
+    def changed(self, file_paths):
+        return sorted(crowdin_sync.get_changed_files(self.repo, file_paths))
+
+    def test_clean(self):
+        self.assertEqual(self.changed(['res/values-de/strings.xml']), [])
+
+    def test_no_files(self):
+        self.assertEqual(self.changed([]), [])
+
+    def test_modified_untracked_deleted(self):
+        self.write('res/values-de/strings.xml', 'new')
+        self.write('res/values-es/strings.xml', 'new')
+        os.remove(os.path.join(self.path, 'res/values-fr/strings.xml'))
+        self.assertEqual(self.changed(['res/values-de/strings.xml', 'res/values-es/strings.xml',
+                                       'res/values-fr/strings.xml']),
+                         ['res/values-de/strings.xml', 'res/values-es/strings.xml',
+                          'res/values-fr/strings.xml'])
+
+    def test_staged(self):
+        # Only differences between the working tree and the index count
+        self.write('res/values-de/strings.xml', 'new')
+        self.repo.git.add('res/values-de/strings.xml')
+        self.assertEqual(self.changed(['res/values-de/strings.xml']), [])
+        self.write('res/values-de/strings.xml', 'newer')
+        self.assertEqual(self.changed(['res/values-de/strings.xml']),
+                         ['res/values-de/strings.xml'])
+
+    def test_rename(self):
+        # The source path following a rename is no entry of its own
+        self.repo.git.mv('res/values-it/strings.xml', 'res/values-it/arrays.xml')
+        self.write('res/values-it/arrays.xml', 'new')
+        self.write('res/values-de/strings.xml', 'new')
+        self.assertEqual(self.changed(['res/values-it/arrays.xml', 'res/values-de/strings.xml']),
+                         ['res/values-de/strings.xml', 'res/values-it/arrays.xml'])
+
+    def test_unchanged_rename(self):
+        self.repo.git.mv('res/values-it/strings.xml', 'res/values-it/arrays.xml')
+        self.assertEqual(self.changed(['res/values-it/arrays.xml']), [])
+
+    def test_special_characters(self):
+        # Paths are neither quoted nor escaped
+        self.write('res/values-de/strings "new" ü.xml', 'new')
+        self.assertEqual(self.changed(['res/values-de/strings "new" ü.xml']),
+                         ['res/values-de/strings "new" ü.xml'])
+
+    def test_directories(self):
+        # Only the directories of the given files are looked at
+        self.write('other/values-de/strings.xml', 'new')
+        self.write('res/values-de/strings.xml', 'new')
+        self.assertEqual(self.changed(['res/values-de/strings.xml']),
+                         ['res/values-de/strings.xml'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# test_clean_xml.py
+#
+# Cleaning downloaded translations: the single pass product filter is checked
+# byte for byte against the former per string XPath filter on large synthetic
+# files, and plurals and string arrays carrying product= are filtered alike.
+#
+#   python -m unittest discover tests
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import unittest
+
+from lxml import etree
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import crowdin_sync  # noqa: E402
+
+_PRODUCTS = ('tablet', 'phone', 'tv', 'default')
+
+
+def reference_clean_xml_file(base_path, project_path, filename, out):
+    # clean_xml_file as it was before products were filtered in a single pass
+    path = base_path + '/' + project_path + '/' + filename
+
+    if not os.path.isfile(path):
+        return crowdin_sync._CLEAN_SKIPPED
+
+    fh = open(path, 'r+')
+
+    XML = fh.read()
+    content = ''
+
+    declaration = XML.split('\n')[0]
+    if '<?' in declaration:
+        content = declaration + '\n'
+        XML = XML[XML.find('\n')+1:]
+
+    try:
+        tree = etree.fromstring(XML)
+    except etree.XMLSyntaxError as err:
+        print(f'{filename}: XML Error: {err.error_log}', file=out)
+        fh.close()
+        filename, ext = os.path.splitext(path)
+        if ext == '.xml':
+            return crowdin_sync._CLEAN_RESET
+        return crowdin_sync._CLEAN_SKIPPED
+
+    productStrings = tree.xpath("//string[@product]")
+    alreadyRemoved = []
+    for ps in productStrings:
+        if ps in alreadyRemoved:
+            continue
+        stringName = ps.get('name')
+        stringsWithSameName = tree.xpath("//string[@name='{0}']".format(stringName))
+
+        hasProductDefault = False
+        for string in stringsWithSameName:
+            product = string.get('product')
+            if product is None or product == 'default':
+                hasProductDefault = True
+                break
+
+        if not hasProductDefault:
+            print(f"\n{path}: Found string '{stringName}' with missing 'product=default' attribute",
+                  end='', file=out)
+            for string in stringsWithSameName:
+                tree.remove(string)
+                alreadyRemoved.append(string)
+
+    header = ''
+    comments = tree.xpath('//comment()')
+    for c in comments:
+        p = c.getparent()
+        if p is None:
+            header += str(c).replace('\\n', '\n').replace('\\t', '\t') + '\n'
+            continue
+        p.remove(c)
+
+    declaration = XML.split('\n')[0]
+    if '<?' in declaration:
+        content = declaration + '\n'
+
+    content += etree.tostring(tree, pretty_print=True, encoding="unicode", xml_declaration=False)
+
+    if header != '':
+        content = content.replace('?>\n', '?>\n' + header)
+
+    content = re.sub(r"[ ]*<\/resources>", "</resources>", content)
+
+    fh.seek(0)
+    fh.write(content)
+    fh.truncate()
+    fh.close()
+
+    contentList = list(tree)
+    if len(contentList) == 0:
+        print(f'\nRemoving {path}', file=out)
+        os.remove(path)
+        return crowdin_sync._CLEAN_REMOVED
+
+    return crowdin_sync._CLEAN_CLEANED
+
+
+def synthetic_strings(seed, count, only_products=False):
+    # Strings without product, with product=default and with other products
+    # only, in random order, with comments in and around the resources
+    rnd = random.Random(seed)
+    lines = ['<?xml version="1.0" encoding="utf-8"?>',
+             '<!-- Copyright (C) 2024 The Android Open Source Project -->',
+             '<resources xmlns:xliff="urn:oasis:names:tc:xliff:document:1.2">']
+    for i in range(count):
+        name = f'string_{i}'
+        kind = 3 if only_products else rnd.randrange(4)
+        if kind == 0:
+            products = [None]
+        elif kind == 1:
+            products = rnd.sample(_PRODUCTS[:3], rnd.randrange(1, 3)) + ['default']
+        elif kind == 2:
+            products = [None] + rnd.sample(_PRODUCTS[:3], 1)
+        else:
+            products = rnd.sample(_PRODUCTS[:3], rnd.randrange(1, 4))
+        rnd.shuffle(products)
+        if rnd.randrange(10) == 0:
+            lines.append(f'    <!-- Comment for {name} -->')
+        for product in products:
+            attr = f' product="{product}"' if product else ''
+            lines.append(f'    <string name="{name}"{attr}>Text {i} '
+                         f'<xliff:g id="n">%d</xliff:g> {product}</string>')
+    lines.append('  </resources>')
+    return '\n'.join(lines) + '\n'
+
+
+class CleanXmlDifferentialTest(unittest.TestCase):
+
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base_path)
+        for project in ('new', 'old'):
+            os.makedirs(os.path.join(self.base_path, project, 'res', 'values-de'))
+
+    def compare(self, content, messages=True):
+        filename = 'res/values-de/strings.xml'
+        results = {}
+        for project, clean in (('new', crowdin_sync.clean_xml_file),
+                               ('old', reference_clean_xml_file)):
+            path = os.path.join(self.base_path, project, filename)
+            with open(path, 'w') as fh:
+                fh.write(content)
+            out = io.StringIO()
+            result = clean(self.base_path, project, filename, out=out)
+            data = None
+            if os.path.exists(path):
+                with open(path, 'rb') as fh:
+                    data = fh.read()
+            # Messages name the file, which differs between both runs
+            results[project] = (result, data, out.getvalue().replace(f'/{project}/', '/'))
+            if not messages:
+                results[project] = results[project][:2]
+        self.assertEqual(results['new'], results['old'])
+        return results['new']
+
+    def test_large_files(self):
+        for seed, count in ((1, 10), (2, 500), (3, 2000)):
+            with self.subTest(seed=seed, count=count):
+                result, data, messages = self.compare(synthetic_strings(seed, count))
+                self.assertEqual(result, crowdin_sync._CLEAN_CLEANED)
+                self.assertIn("with missing 'product=default' attribute", messages)
+
+    def test_clean_file(self):
+        # Cleaning twice gives the same file
+        result, data, _ = self.compare(synthetic_strings(4, 200))
+        self.assertEqual(self.compare(data.decode())[1], data)
+
+    def test_only_products(self):
+        # Every string is dropped, so is the file
+        result, data, messages = self.compare(synthetic_strings(5, 50, only_products=True))
+        self.assertEqual(result, crowdin_sync._CLEAN_REMOVED)
+        self.assertIsNone(data)
+        self.assertIn('Removing ', messages)
+
+    def test_no_declaration(self):
+        content = synthetic_strings(6, 100).split('\n', 1)[1]
+        self.assertEqual(self.compare(content)[0], crowdin_sync._CLEAN_CLEANED)
+
+    def test_syntax_error(self):
+        # libxml2 keeps collecting the errors of earlier parses in the log
+        result, data = self.compare('<resources><string name="a">A</resources>\n',
+                                    messages=False)
+        self.assertEqual(result, crowdin_sync._CLEAN_RESET)
+        self.assertIsNotNone(data)
+
+
+class CleanXmlProductTest(unittest.TestCase):
+
+    def setUp(self):
+        self.base_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base_path)
+        os.makedirs(os.path.join(self.base_path, 'res', 'values-de'))
+        self.path = os.path.join(self.base_path, 'res', 'values-de', 'arrays.xml')
+
+    def clean(self, resources):
+        with open(self.path, 'w') as fh:
+            fh.write('<?xml version="1.0" encoding="utf-8"?>\n'
+                     f'<resources>\n{resources}</resources>\n')
+        out = io.StringIO()
+        stats = {}
+        result = crowdin_sync.clean_xml_file(self.base_path, '.', 'res/values-de/arrays.xml',
+                                             out=out, stats=stats)
+        tree = etree.parse(self.path) if os.path.exists(self.path) else None
+        return result, tree, out.getvalue(), stats
+
+    def test_plurals(self):
+        result, tree, messages, stats = self.clean(
+            '  <plurals name="kept" product="tablet"><item quantity="one">A</item></plurals>\n'
+            '  <plurals name="kept"><item quantity="one">B</item></plurals>\n'
+            '  <plurals name="dropped" product="tablet"><item quantity="one">C</item></plurals>\n'
+            '  <plurals name="dropped" product="tv"><item quantity="one">D</item></plurals>\n')
+        self.assertEqual(result, crowdin_sync._CLEAN_CLEANED)
+        self.assertEqual([p.get('name') for p in tree.iter('plurals')], ['kept', 'kept'])
+        self.assertIn("Found plurals 'dropped' with missing 'product=default' attribute",
+                      messages)
+        self.assertNotIn("'kept'", messages)
+        self.assertEqual(stats['strings_dropped'], 2)
+
+    def test_string_array(self):
+        result, tree, messages, stats = self.clean(
+            '  <string-array name="kept" product="default"><item>A</item></string-array>\n'
+            '  <string-array name="kept" product="tv"><item>B</item></string-array>\n'
+            '  <string-array name="dropped" product="tv"><item>C</item></string-array>\n')
+        self.assertEqual([a.get('product') for a in tree.iter('string-array')],
+                         ['default', 'tv'])
+        self.assertIn("Found string-array 'dropped' with missing 'product=default' attribute",
+                      messages)
+        self.assertEqual(stats['strings_dropped'], 1)
+
+    def test_tags_are_separate(self):
+        # A string does not provide the default of an array with the same name
+        result, tree, messages, _ = self.clean(
+            '  <string name="name">A</string>\n'
+            '  <string-array name="name" product="tv"><item>B</item></string-array>\n'
+            '  <plurals name="name" product="tv"><item quantity="one">C</item></plurals>\n')
+        self.assertEqual([e.tag for e in tree.getroot()], ['string'])
+        self.assertIn("Found string-array 'name'", messages)
+        self.assertIn("Found plurals 'name'", messages)
+
+    def test_only_products(self):
+        result, tree, messages, _ = self.clean(
+            '  <plurals name="p" product="tv"><item quantity="one">A</item></plurals>\n'
+            '  <string-array name="a" product="tv"><item>B</item></string-array>\n')
+        self.assertEqual(result, crowdin_sync._CLEAN_REMOVED)
+        self.assertIsNone(tree)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# test_gerrit.py
+#
+# Querying and submitting open translation changes against
+# tools/fake_gerrit_ssh.py: paged queries, changes dropping out of them while
+# they are submitted and connections failing now and then.
+#
+#   python -m unittest discover tests
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from unittest import mock
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, _ROOT)
+
+import crowdin_sync  # noqa: E402
+
+_FAKE_GERRIT_SSH = [sys.executable, os.path.join(_ROOT, 'tools', 'fake_gerrit_ssh.py')]
+
+
+class SubmitGerritTest(unittest.TestCase):
+
+    def setUp(self):
+        work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, work_dir)
+        self.log = os.path.join(work_dir, 'gerrit.log')
+        # AICP_GERRIT_SSH is read on import, so the fake is set up directly
+        for patch in (mock.patch.object(crowdin_sync, '_GERRIT_SSH', _FAKE_GERRIT_SSH),
+                      mock.patch.object(crowdin_sync.time, 'sleep'),
+                      mock.patch.dict(os.environ, {'FAKE_GERRIT_LOG': self.log})):
+            patch.start()
+            self.addCleanup(patch.stop)
+        for key in ('FAKE_GERRIT_REMOTES', 'FAKE_GERRIT_FLAKY', 'FAKE_GERRIT_DELAY'):
+            os.environ.pop(key, None)
+        crowdin_sync.reset_metrics()
+
+    def submit(self, changes, limit, flaky=0.0, jobs=4):
+        os.environ.update({'FAKE_GERRIT_CHANGES': str(changes),
+                           'FAKE_GERRIT_LIMIT': str(limit),
+                           'FAKE_GERRIT_FLAKY': str(flaky)})
+        out = io.StringIO()
+        err = io.StringIO()
+        with contextlib.redirect_stdout(out), contextlib.redirect_stderr(err):
+            result = crowdin_sync.submit_gerrit('master', 'user', None, jobs)
+        return result, out.getvalue(), err.getvalue()
+
+    def commands(self, name):
+        if not os.path.exists(self.log):
+            return []
+        with open(self.log, 'r') as fh:
+            return [line.split() for line in fh if line.startswith(f'gerrit {name} ')]
+
+    def submitted(self):
+        return collections.Counter(cmd[-1] for cmd in self.commands('review')
+                                   if '--submit' in cmd)
+
+    def test_paged(self):
+        result, out, err = self.submit(7, 3)
+        self.assertTrue(result)
+        self.assertNotIn('Could not open a shared ssh connection', out)
+        # Every change is submitted exactly once
+        self.assertEqual(self.submitted(), {f'{i:040x}': 1 for i in range(7)})
+        self.assertIn('Submitted 7 of 7 changes', out)
+        self.assertEqual(crowdin_sync._METRICS['counts'].get('changes_submitted'), 7)
+        # Submitted changes shift the later pages, so the query runs again
+        # from the start after going through several pages
+        starts = [int(cmd[cmd.index('--start') + 1]) for cmd in self.commands('query')]
+        self.assertGreater(len(starts), 2)
+        self.assertGreater(starts.count(0), 1)
+
+    def test_single_page(self):
+        result, out, err = self.submit(3, 500)
+        self.assertTrue(result)
+        self.assertEqual(len(self.commands('query')), 1)
+        self.assertEqual(self.submitted(), {f'{i:040x}': 1 for i in range(3)})
+
+    def test_nothing_open(self):
+        result, out, err = self.submit(0, 3)
+        self.assertTrue(result)
+        self.assertIn('Nothing to submit!', out)
+        self.assertEqual(self.commands('review'), [])
+
+    def test_flaky(self):
+        # Half of the connections fail, enough retries make every one succeed
+        with mock.patch.object(crowdin_sync, '_GERRIT_RETRIES', 40):
+            result, out, err = self.submit(7, 3, flaky=0.5)
+        self.assertTrue(result)
+        self.assertEqual(self.submitted(), {f'{i:040x}': 1 for i in range(7)})
+        self.assertIn('Submitted 7 of 7 changes', out)
+
+    def test_query_fails(self):
+        # Every query page is retried, then the failure is reported
+        result, out, err = self.submit(7, 3, flaky=1.0)
+        self.assertFalse(result)
+        self.assertEqual(err.count('Query failed, retrying'), crowdin_sync._GERRIT_RETRIES - 1)
+        self.assertIn('Failed to query open changes', out)
+        self.assertEqual(crowdin_sync._METRICS['counts'].get('queries_failed'), 1)
+        self.assertEqual(self.commands('review'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# test_project_resolver.py
+#
+# Finding the project roots of config paths and the manifest projects owning
+# them, including nested projects and project paths containing /res.
+#
+#   python -m unittest discover tests
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import sys
+import unittest
+
+from lxml import etree
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import crowdin_sync  # noqa: E402
+
+
+def manifest(*paths):
+    projects = ''.join(f'<project path="{p}" name="AICP/{p.replace("/", "_")}"/>' for p in paths)
+    return etree.ElementTree(etree.fromstring(f'<manifest>{projects}</manifest>'))
+
+
+class GetProjectRootTest(unittest.TestCase):
+
+    def test_single_res(self):
+        self.assertEqual(crowdin_sync.get_project_root(
+            '/packages/apps/Settings/res/values/strings.xml'), 'packages/apps/Settings')
+
+    def test_double_res(self):
+        # /res is part of the project path as well
+        self.assertEqual(crowdin_sync.get_project_root(
+            '/vendor/aicp/overlay/res/common/res/values/strings.xml'),
+            'vendor/aicp/overlay/res/common')
+
+    def test_translation_path(self):
+        self.assertEqual(crowdin_sync.get_project_root(
+            'frameworks/base/core/res/res/values-de/strings.xml'), 'frameworks/base/core/res')
+
+    def test_no_res(self):
+        self.assertIsNone(crowdin_sync.get_project_root('/packages/apps/Settings/strings.xml'))
+
+    def test_too_many_res(self):
+        self.assertIsNone(crowdin_sync.get_project_root('/a/res/b/res/c/res/values/strings.xml'))
+
+
+class ResolveProjectTest(unittest.TestCase):
+
+    def setUp(self):
+        self.manifests = (
+            manifest('frameworks/base', 'frameworks/base/packages/SystemUI',
+                     'vendor/aicp/overlay/res/common'),
+            manifest('packages/apps/Settings', 'frameworks/base'),
+        )
+        self.resolver = crowdin_sync.load_project_resolver(self.manifests)
+
+    def resolve(self, path):
+        project_path, project = crowdin_sync.resolve_project(self.resolver, path)
+        return project_path, project.get('name') if project is not None else None
+
+    def test_project(self):
+        self.assertEqual(self.resolve('packages/apps/Settings/res/values-de/strings.xml'),
+                         ('packages/apps/Settings', 'AICP/packages_apps_Settings'))
+
+    def test_nested_project(self):
+        # The longest matching project wins
+        self.assertEqual(
+            self.resolve('frameworks/base/packages/SystemUI/res/values/strings.xml'),
+            ('frameworks/base/packages/SystemUI', 'AICP/frameworks_base_packages_SystemUI'))
+        self.assertEqual(self.resolve('frameworks/base/core/res/res/values/strings.xml'),
+                         ('frameworks/base', 'AICP/frameworks_base'))
+
+    def test_project_root(self):
+        self.assertEqual(self.resolve('/frameworks/base/packages/SystemUI/'),
+                         ('frameworks/base/packages/SystemUI',
+                          'AICP/frameworks_base_packages_SystemUI'))
+
+    def test_double_res(self):
+        path = 'vendor/aicp/overlay/res/common/res/values-fr/strings.xml'
+        root = crowdin_sync.get_project_root(path)
+        self.assertEqual(self.resolve(root), ('vendor/aicp/overlay/res/common',
+                                              'AICP/vendor_aicp_overlay_res_common'))
+        self.assertEqual(self.resolve(path)[0], root)
+
+    def test_first_manifest_wins(self):
+        _, project = crowdin_sync.resolve_project(self.resolver, 'frameworks/base')
+        self.assertIs(project.getparent(), self.manifests[0].getroot())
+
+    def test_partial_component(self):
+        # Matching is by whole path components, not by prefix
+        self.assertEqual(self.resolve('frameworks/base2/res/values/strings.xml'),
+                         (None, None))
+
+    def test_unknown(self):
+        self.assertEqual(self.resolve('packages/apps/Unknown/res/values/strings.xml'),
+                         (None, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
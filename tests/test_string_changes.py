@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# test_string_changes.py
+#
+# Comparing translation files string by string, which decides whether a
+# changed file is committed or reverted as holding the same translations.
+#
+#   python -m unittest discover tests
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+import git
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+import crowdin_sync  # noqa: E402
+
+_XLIFF = 'xmlns:xliff="urn:oasis:names:tc:xliff:document:1.2"'
+
+
+def resources(body, attrib=_XLIFF):
+    return (f'<?xml version="1.0" encoding="utf-8"?>\n'
+            f'<resources {attrib}>\n{body}\n</resources>\n').encode()
+
+
+def changes(old, new):
+    return crowdin_sync.count_string_changes(crowdin_sync.get_resource_map(resources(old)),
+                                             crowdin_sync.get_resource_map(resources(new)))
+
+
+class ResourceValueTest(unittest.TestCase):
+
+    def test_whitespace(self):
+        # Outside of quotes, aapt collapses whitespace and trims both ends
+        self.assertEqual(changes('<string name="a">Hello   world</string>',
+                                 '<string name="a">\n    Hello\tworld </string>'), 0)
+
+    def test_whitespace_around_markup(self):
+        self.assertEqual(changes('<string name="a">Hello  <b>big</b>   world</string>',
+                                 '<string name="a">Hello <b>big</b> world</string>'), 0)
+
+    def test_quoted_whitespace(self):
+        # Quoted values keep their whitespace
+        self.assertEqual(changes('<string name="a">"Hello   world"</string>',
+                                 '<string name="a">"Hello world"</string>'), 1)
+        self.assertEqual(changes('<string name="a">" Hello"</string>',
+                                 '<string name="a">"Hello"</string>'), 1)
+
+    def test_backslash_escapes(self):
+        # aapt rejects an unescaped apostrophe, so this is a real change
+        self.assertEqual(changes('<string name="a">It\\\'s</string>',
+                                 '<string name="a">It\'s</string>'), 1)
+        self.assertEqual(changes('<string name="a">Line\\nbreak</string>',
+                                 '<string name="a">Line\nbreak</string>'), 1)
+        self.assertEqual(changes('<string name="a">It\\\'s</string>',
+                                 '<string name="a">It\\\'s</string>'), 0)
+
+    def test_xml_escaping(self):
+        self.assertEqual(changes('<string name="a">A &amp; B &lt; C</string>',
+                                 '<string name="a">A &#38; B &#60; C</string>'), 0)
+        self.assertEqual(changes('<string name="a">&quot;A&quot;</string>',
+                                 '<string name="a">"A"</string>'), 0)
+
+    def test_text(self):
+        self.assertEqual(changes('<string name="a">Hello</string>',
+                                 '<string name="a">Hallo</string>'), 1)
+
+    def test_markup(self):
+        # Attribute order doesn't matter, attribute values and tags do
+        self.assertEqual(
+            changes('<string name="a"><xliff:g id="n" example="1">%d</xliff:g> files</string>',
+                    '<string name="a"><xliff:g example="1" id="n">%d</xliff:g> files</string>'),
+            0)
+        self.assertEqual(changes('<string name="a"><xliff:g id="n">%d</xliff:g> files</string>',
+                                 '<string name="a"><xliff:g id="m">%d</xliff:g> files</string>'),
+                         1)
+        self.assertEqual(changes('<string name="a"><b>bold</b></string>',
+                                 '<string name="a"><i>bold</i></string>'), 1)
+
+    def test_attributes(self):
+        self.assertEqual(changes('<string name="a" formatted="false">%</string>',
+                                 '<string formatted="false" name="a">%</string>'), 0)
+        self.assertEqual(changes('<string name="a" formatted="false">%</string>',
+                                 '<string name="a">%</string>'), 1)
+
+
+class ResourceMapTest(unittest.TestCase):
+
+    def test_order_and_comments(self):
+        self.assertEqual(changes('<!-- a --><string name="a">A</string>\n'
+                                 '<string name="b">B</string>',
+                                 '<string name="b">B</string>\n'
+                                 '<string name="a">A</string>'), 0)
+
+    def test_added_removed_changed(self):
+        self.assertEqual(changes('<string name="a">A</string>\n<string name="b">B</string>',
+                                 '<string name="b">X</string>\n<string name="c">C</string>'), 3)
+
+    def test_plurals(self):
+        # Plurals are compared by quantity, not by order
+        old = ('<plurals name="p"><item quantity="one">%d file</item>'
+               '<item quantity="other">%d files</item></plurals>')
+        self.assertEqual(changes(old, '<plurals name="p"><item quantity="other">%d files</item>'
+                                      '<item quantity="one">%d file</item></plurals>'), 0)
+        self.assertEqual(changes(old, '<plurals name="p"><item quantity="one">%d file</item>'
+                                      '<item quantity="other">%d Dateien</item></plurals>'), 1)
+        self.assertEqual(changes(old, '<plurals name="p"><item quantity="one">%d file</item>'
+                                      '</plurals>'), 1)
+
+    def test_arrays(self):
+        # The order of array items matters
+        old = '<string-array name="a"><item>A</item><item>B</item></string-array>'
+        self.assertEqual(changes(old, '<string-array name="a">\n  <item>A</item>\n'
+                                      '  <item>B</item>\n</string-array>'), 0)
+        self.assertEqual(changes(old, '<string-array name="a"><item>B</item><item>A</item>'
+                                      '</string-array>'), 1)
+        self.assertEqual(changes('<integer-array name="a"><item>1</item></integer-array>',
+                                 '<integer-array name="a"><item>2</item></integer-array>'), 1)
+
+    def test_types_and_products(self):
+        # The same name in another type or product is another resource
+        self.assertEqual(changes('<string name="a">A</string>\n'
+                                 '<string name="a" product="tablet">T</string>',
+                                 '<string name="a" product="tablet">T</string>\n'
+                                 '<string name="a">A</string>'), 0)
+        self.assertEqual(changes('<string name="a">A</string>',
+                                 '<string name="a" product="tablet">A</string>'), 2)
+        self.assertEqual(changes('<string name="a">A</string>',
+                                 '<string-array name="a"><item>A</item></string-array>'), 2)
+
+    def test_root_attributes(self):
+        tools = 'xmlns:tools="http://schemas.android.com/tools"'
+        old = crowdin_sync.get_resource_map(resources(
+            '<string name="a">A</string>', f'{tools} tools:ignore="MissingTranslation"'))
+        new = crowdin_sync.get_resource_map(resources('<string name="a">A</string>', tools))
+        self.assertEqual(crowdin_sync.count_string_changes(old, new), 1)
+        # Namespace declarations are no attributes
+        new = crowdin_sync.get_resource_map(resources('<string name="a">A</string>', ''))
+        old = crowdin_sync.get_resource_map(resources('<string name="a">A</string>'))
+        self.assertEqual(crowdin_sync.count_string_changes(old, new), 0)
+
+    def test_duplicates(self):
+        # A resource defined twice can't be compared
+        self.assertIsNone(crowdin_sync.get_resource_map(
+            resources('<string name="a">A</string>\n<string name="a">A</string>')))
+        self.assertIsNone(changes('<string name="a">A</string>',
+                                  '<string name="a">A</string>\n<string name="a">B</string>'))
+
+    def test_syntax_error(self):
+        self.assertIsNone(crowdin_sync.get_resource_map(b'<resources><string name="a">'))
+        self.assertIsNone(crowdin_sync.count_string_changes(
+            None, crowdin_sync.get_resource_map(resources(''))))
+
+
+class StringChangesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        self.repo = git.Repo.init(self.path)
+        self.addCleanup(self.repo.close)
+        with self.repo.config_writer() as config:
+            config.set_value('user', 'name', 'Test')
+            config.set_value('user', 'email', 'test@localhost')
+        self.write('res/values-de/strings.xml', '<string name="a">A</string>')
+        self.write('res/values-fr/strings.xml', '<string name="a">A</string>\n'
+                                                '<string name="b">B</string>')
+        self.repo.git.add('-A')
+        self.repo.git.commit('-q', '-m', 'Initial commit')
+
+    def write(self, path, body):
+        os.makedirs(os.path.join(self.path, os.path.dirname(path)), exist_ok=True)
+        with open(os.path.join(self.path, path), 'wb') as fh:
+            fh.write(resources(body))
+
+    def test_changes(self):
+        self.write('res/values-de/strings.xml', '<string name="a">\n    A\n</string>')
+        self.write('res/values-es/strings.xml', '<string name="a">A</string>\n'
+                                                '<string name="b">B</string>')
+        os.remove(os.path.join(self.path, 'res/values-fr/strings.xml'))
+        self.write('res/values-it/strings.xml', '')
+        self.assertEqual(crowdin_sync.get_string_changes(
+            self.repo, ['res/values-de/strings.xml', 'res/values-es/strings.xml',
+                        'res/values-fr/strings.xml', 'res/values-it/strings.xml']),
+            {'res/values-de/strings.xml': 0, 'res/values-es/strings.xml': 2,
+             'res/values-fr/strings.xml': 2, 'res/values-it/strings.xml': 1})
+
+    def test_unparsable(self):
+        with open(os.path.join(self.path, 'res/values-de/strings.xml'), 'w') as fh:
+            fh.write('<resources><string name="a">')
+        self.assertEqual(crowdin_sync.get_string_changes(self.repo, ['res/values-de/strings.xml']),
+                         {'res/values-de/strings.xml': None})
+
+
+if __name__ == '__main__':
+    unittest.main()
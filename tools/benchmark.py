@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# benchmark.py
+#
+# Measures the hot paths of crowdin_sync.py on a synthetic workspace, without
+# Crowdin, Gerrit or an AICP checkout. A base path with git repositories,
+# translation exports (with product variants, comments and empty files), a
+# matching config and manifest are generated, then every phase is timed in
+# isolation. Pushes go to local bare repositories. Finally the whole sync after
+# the download runs once stage by stage and once as pipeline, each on a fresh
+# workspace, timing them in total and up to the first push.
+#
+# Results are written as JSON, so they can be compared across versions:
+#
+#   ./tools/benchmark.py --repos 20 --files 5 --languages 80 -o bench.json
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# ################################# IMPORTS ################################## #
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import crowdin_sync
+
+from concurrent.futures import ThreadPoolExecutor
+from lxml import etree
+
+# ################################# GLOBALS ################################## #
+
+_BRANCH = 'bench'
+_DIR = os.path.dirname(os.path.realpath(__file__))
+_GIT_ENV = {
+    'GIT_AUTHOR_NAME': 'Benchmark',
+    'GIT_AUTHOR_EMAIL': 'benchmark@localhost',
+    'GIT_COMMITTER_NAME': 'Benchmark',
+    'GIT_COMMITTER_EMAIL': 'benchmark@localhost',
+}
+
+# ################################ WORKSPACE ################################# #
+
+
+def git(cwd, *args):
+    subprocess.run(['git', *args], cwd=cwd, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def generate_strings(rnd, count, lang):
+    # A resources file like Crowdin exports it
+    lines = ['<?xml version="1.0" encoding="utf-8"?>',
+             '<!-- Copyright (C) The AICP Project -->',
+             '<resources xmlns:xliff="urn:oasis:names:tc:xliff:document:1.2">']
+    for i in range(count):
+        r = rnd.random()
+        if r < 0.1:
+            lines.append(f'    <!-- Comment on string_{i} -->')
+        if r < 0.7:
+            lines.append(f'    <string name="string_{i}">{lang} {i}</string>')
+        elif r < 0.8:
+            # Product variants with a default one
+            lines.append(f'    <string name="string_{i}" product="tablet">{lang} {i}</string>')
+            lines.append(f'    <string name="string_{i}" product="default">{lang} {i}</string>')
+        elif r < 0.85:
+            # Product variants without a default one, which get removed
+            lines.append(f'    <string name="string_{i}" product="tablet">{lang} {i}</string>')
+            lines.append(f'    <string name="string_{i}" product="tv">{lang} {i}</string>')
+        elif r < 0.95:
+            lines.append(f'    <plurals name="plurals_{i}">')
+            lines.append(f'        <item quantity="one">{lang} {i}</item>')
+            lines.append(f'        <item quantity="other">{lang} {i}s</item>')
+            lines.append('    </plurals>')
+        else:
+            lines.append(f'    <string-array name="array_{i}">')
+            lines.append(f'        <item>{lang} {i}</item>')
+            lines.append('    </string-array>')
+    lines.append('</resources>')
+    return '\n'.join(lines) + '\n'
+
+
+def generate_empty():
+    return ('<?xml version="1.0" encoding="utf-8"?>\n'
+            '<resources xmlns:xliff="urn:oasis:names:tc:xliff:document:1.2">\n'
+            '    <!-- Nothing translated yet -->\n'
+            '</resources>\n')
+
+
+def generate_workspace(work_dir, repos, files, languages, strings, empty, seed):
+    # Returns the paths of config and manifest and a dict of the raw exports
+    rnd = random.Random(seed)
+    base_path = os.path.join(work_dir, 'base')
+    remotes = os.path.join(work_dir, 'remotes')
+    langs = [f'l{i}' for i in range(languages)]
+    config = ['"files": [']
+    manifest = ['<?xml version="1.0" encoding="UTF-8"?>', '<manifest>']
+    exports = {}
+
+    for r in range(repos):
+        project_path = f'packages/apps/Project{r}'
+        name = f'AICP/packages_apps_Project{r}'
+        manifest.append(f'  <project path="{project_path}" name="{name}" />')
+        repo_dir = os.path.join(base_path, project_path)
+
+        for f in range(files):
+            file_name = f'strings_{f}.xml'
+            source = f'/{project_path}/res/values/{file_name}'
+            os.makedirs(os.path.join(repo_dir, 'res', 'values'), exist_ok=True)
+            with open(base_path + source, 'w') as fh:
+                fh.write(generate_strings(rnd, strings, 'en'))
+            mapping = '&anchor {"android_code": {' if r == 0 and f == 0 else '*anchor'
+            if r == 0 and f == 0:
+                mapping += ', '.join(f'"{l}": "{l}-rXX"' for l in langs) + '}}'
+            config.append(f'  {{"source": "{source}",')
+            config.append(f'   "translation": "/{project_path}/res/values-%android_code%/'
+                          '%original_file_name%",')
+            config.append(f'   "languages_mapping": {mapping}}},')
+
+            for l in langs:
+                target = f'{project_path}/res/values-{l}-rXX/{file_name}'
+                if rnd.random() < empty:
+                    exports[target] = generate_empty()
+                else:
+                    exports[target] = generate_strings(rnd, strings, l)
+
+        # Half of the translations are already committed, in an older state
+        git(repo_dir, 'init', '-q', '-b', _BRANCH)
+        for target, content in exports.items():
+            if target.startswith(project_path + '/') and rnd.random() < 0.5:
+                path = os.path.join(base_path, target)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'w') as fh:
+                    fh.write(content.replace('</resources>', '    <string name="old">old</string>\n</resources>'))
+        git(repo_dir, 'add', '-A')
+        git(repo_dir, 'commit', '-q', '-m', 'Initial commit')
+
+        # Gerrit takes the topic as push option, a plain bare repository must
+        # be told to accept them
+        remote = os.path.join(remotes, name)
+        os.makedirs(remote)
+        git(remote, 'init', '-q', '--bare')
+        git(remote, 'config', 'receive.advertisePushOptions', 'true')
+
+    config[-1] = config[-1].rstrip(',')
+    config.append(']')
+    manifest.append('</manifest>')
+
+    config_file = os.path.join(work_dir, f'{_BRANCH}.yml')
+    with open(config_file, 'w') as fh:
+        fh.write('\n'.join(config) + '\n')
+    manifest_file = os.path.join(work_dir, 'crowdin.xml')
+    with open(manifest_file, 'w') as fh:
+        fh.write('\n'.join(manifest) + '\n')
+    return base_path, remotes, config_file, manifest_file, exports
+
+
+def write_exports(base_path, exports):
+    # Put the raw exports in place again, like a Crowdin download does
+    for target, content in exports.items():
+        path = os.path.join(base_path, target)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as fh:
+            fh.write(content)
+
+# ################################ BENCHMARK ################################# #
+
+
+@contextlib.contextmanager
+def phase(results, name, **counts):
+    # Time the enclosed code, keeping its output out of the way
+    out = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(out), contextlib.redirect_stderr(out):
+        yield counts
+    results[name] = dict(counts, seconds=round(time.perf_counter() - start, 6))
+    print(f'{name:>16}: {results[name]["seconds"]:.3f}s', file=sys.stderr)
+
+
+def get_entries(base_path, project_targets, projects):
+    return [(base_path, p, f) for p in projects
+            for f in sorted(crowdin_sync.get_project_target_paths(project_targets, p))]
+
+
+def get_branch(base_path, config_file, manifest_file):
+    # A branch like crowdin_sync.load_branch() returns it, without cache
+    config = crowdin_sync.load_config([config_file])
+    xml_files = (etree.parse(manifest_file),)
+    config_index = crowdin_sync.load_config_index(config)
+    resolver = crowdin_sync.load_project_resolver(xml_files)
+    return {
+        'name': _BRANCH,
+        'base_path': base_path,
+        'xml': xml_files,
+        'config': config,
+        'config_index': config_index,
+        'resolver': resolver,
+        'project_targets': crowdin_sync.load_project_targets(config_index, resolver),
+        'api': None,
+        'cache': None,
+        'sync_state': None,
+        'language_index': crowdin_sync.load_language_index(config),
+        'languages': None,
+        'deferred': set(),
+    }
+
+
+def run_sync(args, work_dir, pipeline):
+    # Everything after the download on a fresh workspace: the stages one after
+    # the other like before, or overlapping in crowdin_sync.sync_branches()
+    os.makedirs(work_dir)
+    base_path, remotes, config_file, manifest_file, exports = generate_workspace(
+        work_dir, args.repos, args.files, args.languages, args.strings, args.empty,
+        args.seed)
+    crowdin_sync._GERRIT_PUSH_URL = 'file://' + remotes
+    os.environ['FAKE_GERRIT_REMOTES'] = remotes
+    branch = get_branch(base_path, config_file, manifest_file)
+    crowdin_sync.reset_metrics()
+
+    if pipeline:
+        results = crowdin_sync.sync_branches(
+            [branch], 'benchmark', lambda b, arrived: write_exports(base_path, exports),
+            args.jobs, args.jobs, args.jobs)[0]
+        results = [r for c, r, f in results]
+    else:
+        write_exports(base_path, exports)
+        entries = crowdin_sync.get_branch_entries(branch)
+        crowdin_sync.clean_xml_files(entries, args.jobs)
+        commits = crowdin_sync.get_branch_commits(branch, 'benchmark')
+        open_changes = crowdin_sync.get_open_changes('benchmark', {_BRANCH})
+        # The repositories are committed concurrently, like in the pipeline
+        push_lock = threading.BoundedSemaphore(args.jobs)
+        with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+            futures = [executor.submit(crowdin_sync.push_as_commit_buffered, push_lock, False,
+                                       open_changes, None, *c)
+                       for c in commits]
+            results = [future.result()[0] for future in futures]
+    return results.count(True), crowdin_sync.get_metrics()['first_push_seconds']
+
+
+def run_benchmark(args, work_dir):
+    results = {}
+    base_path, remotes, config_file, manifest_file, exports = generate_workspace(
+        work_dir, args.repos, args.files, args.languages, args.strings, args.empty,
+        args.seed)
+
+    with phase(results, 'config', files=len(exports)):
+        config = crowdin_sync.load_config([config_file])
+        config_index = crowdin_sync.load_config_index(config)
+
+    with phase(results, 'resolve') as counts:
+        resolver = crowdin_sync.load_project_resolver((etree.parse(manifest_file),))
+        projects = set()
+        for source in sorted(config_index):
+            root = crowdin_sync.get_project_root(source)
+            projects.add(crowdin_sync.resolve_project(resolver, root)[0])
+        projects = sorted(projects)
+        project_targets = crowdin_sync.load_project_targets(config_index, resolver)
+        counts['projects'] = len(projects)
+
+    entries = get_entries(base_path, project_targets, projects)
+    empty = [e for e in entries if exports[os.path.join(e[1], e[2])] == generate_empty()]
+
+    # The empty-file sweep is part of the cleaning, this times it on its own
+    write_exports(base_path, exports)
+    with phase(results, 'sweep', files=len(empty)) as counts:
+        counts['results'] = crowdin_sync.clean_xml_files(empty, 1)[0]
+
+    write_exports(base_path, exports)
+    with phase(results, 'clean', files=len(entries)) as counts:
+        counts['results'] = crowdin_sync.clean_xml_files(entries, 1)[0]
+
+    write_exports(base_path, exports)
+    with phase(results, 'clean_parallel', files=len(entries), jobs=args.jobs) as counts:
+        counts['results'] = crowdin_sync.clean_xml_files(entries, args.jobs)[0]
+
+    repos = {p: crowdin_sync.git.Repo(os.path.join(base_path, p)) for p in projects}
+    with phase(results, 'stage', repos=len(repos)) as counts:
+        counts['files'] = sum(
+            crowdin_sync.add_target_paths(project_targets, repo, base_path, p, clean=False)
+            for p, repo in repos.items())
+
+    with phase(results, 'commit', repos=len(repos)):
+        for repo in repos.values():
+            repo.git.commit(m='Automatic AICP translation import')
+
+    crowdin_sync._GERRIT_PUSH_URL = 'file://' + remotes
+    names = {p.get('path'): p.get('name') for p in etree.parse(manifest_file).iter('project')}
+    with phase(results, 'push', repos=len(repos)):
+        for p, repo in repos.items():
+            crowdin_sync.push_commit(repo, names[p], _BRANCH, 'benchmark')
+
+    # Open changes are looked up in the bare repositories
+    crowdin_sync._GERRIT_SSH = [os.path.join(_DIR, 'fake_gerrit_ssh.py')]
+    for name, pipeline in (('sync_staged', False), ('sync_pipeline', True)):
+        with phase(results, name, jobs=args.jobs) as counts:
+            counts['pushed'], counts['first_push_seconds'] = run_sync(
+                args, os.path.join(work_dir, name), pipeline)
+
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark crowdin_sync.py on a synthetic workspace")
+    parser.add_argument('--repos', type=int, default=10, help='Number of repositories')
+    parser.add_argument('--files', type=int, default=3,
+                        help='Number of resource files per repository')
+    parser.add_argument('--languages', type=int, default=80, help='Number of languages')
+    parser.add_argument('--strings', type=int, default=200,
+                        help='Number of strings per resource file')
+    parser.add_argument('--empty', type=float, default=0.2,
+                        help='Fraction of exports without any translation')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='Number of processes for the parallel cleaning and of '
+                             'repositories committed at once in the sync phases')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--work-dir', help='Keep the workspace in this directory')
+    parser.add_argument('-o', '--output', help='JSON result file (default: stdout)')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    os.environ.update(_GIT_ENV)
+
+    if args.work_dir:
+        shutil.rmtree(args.work_dir, ignore_errors=True)
+        os.makedirs(args.work_dir)
+        phases = run_benchmark(args, args.work_dir)
+    else:
+        with tempfile.TemporaryDirectory(prefix='crowdin_bench_') as work_dir:
+            phases = run_benchmark(args, work_dir)
+
+    params = {k: v for k, v in vars(args).items() if k not in ('work_dir', 'output')}
+    result = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'params': params,
+        'phases': phases,
+    }
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(result, fh, indent=2)
+            fh.write('\n')
+    else:
+        print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
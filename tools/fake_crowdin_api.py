@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# fake_crowdin_api.py
+#
+# Local stand-in for the parts of the Crowdin API v2 that the API backend of
+# crowdin_sync.py uses, to test and measure it without a live project.
+# Start it and point the script to it with:
+#
+#   ./tools/fake_crowdin_api.py --data DIR --branch s12.1 &
+#   export AICP_CROWDIN_API_URL=http://localhost:8080/api/v2
+#   export AICP_CROWDIN_API_TOKEN=anything
+#   ./crowdin_sync.py --branch s12.1 --backend api --local-download
+#
+# The data directory holds what the project contains:
+#   DIR/translations/<language id>/<path>  exported translation files
+#   DIR/sources/<path>                     source files existing in the branch
+#
+# Exports of single files (used by incremental downloads) additionally need
+# the branch's config, to find the exported file of a source.
+#
+# GET /stats returns the number of requests and connections served so far.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# ################################# IMPORTS ################################## #
+
+import argparse
+import hashlib
+import io
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+import time
+import yaml
+import zipfile
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# ################################# GLOBALS ################################## #
+
+_LOCK = threading.Lock()
+_IDS = itertools.count(1)
+_STATE = {
+    'builds': {},
+    'storages': {},
+    'uploads': {},
+    'requests': 0,
+    'connections': 0,
+}
+
+# ################################ FUNCTIONS ################################# #
+
+
+def list_files(path):
+    # All files below the given directory, relative to it
+    for dp, dn, file_names in os.walk(path):
+        for f in file_names:
+            yield os.path.relpath(os.path.join(dp, f), path)
+
+
+def find_export(data_dir, config, source, lang):
+    # Path of the exported file of the given source in the given language,
+    # relative to the language's directory
+    for tf in config or []:
+        if tf['source'].lstrip('/') != source:
+            continue
+        original_path, original_file_name = os.path.split(tf['source'])
+        pattern = re.escape(tf['translation'].lstrip('/'))
+        pattern = pattern.replace(re.escape('%original_path%'),
+                                  re.escape(original_path.lstrip('/')))
+        pattern = pattern.replace(re.escape('%original_file_name%'),
+                                  re.escape(original_file_name))
+        pattern = pattern.replace(re.escape('%android_code%'), '[^/]+')
+        for f in list_files(os.path.join(data_dir, 'translations', lang)):
+            if re.fullmatch(pattern, f):
+                return f
+    return None
+
+
+def build_archive(data_dir, langs):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as z:
+        for lang in langs:
+            lang_dir = os.path.join(data_dir, 'translations', lang)
+            for f in sorted(list_files(lang_dir)):
+                z.write(os.path.join(lang_dir, f), f)
+    return buf.getvalue()
+
+
+class CrowdinHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_version = 'FakeCrowdin/1.0'
+
+    def setup(self):
+        super().setup()
+        with _LOCK:
+            _STATE['connections'] += 1
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+    def send(self, code, body=b'', content_type='application/json'):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return self.rfile.read(length)
+
+    def handle_request(self, method):
+        with _LOCK:
+            _STATE['requests'] += 1
+        url = urlparse(self.path)
+        query = {k: v[0] for k, v in parse_qs(url.query).items()}
+        body = self.read_body()
+
+        if url.path == '/stats':
+            with _LOCK:
+                return self.send(200, {'requests': _STATE['requests'],
+                                       'connections': _STATE['connections']})
+
+        m = re.fullmatch(r'/exports/([^/]+)/(.+)', url.path)
+        if m and method == 'GET':
+            path = os.path.join(self.server.data_dir, 'translations', m.group(1), m.group(2))
+            if not os.path.isfile(path):
+                return self.send(404)
+            with open(path, 'rb') as fh:
+                return self.send(200, fh.read(), 'application/xml')
+
+        m = re.fullmatch(r'/archives/(\d+)\.zip', url.path)
+        if m and method == 'GET':
+            build = _STATE['builds'].get(int(m.group(1)))
+            if build is None:
+                return self.send(404)
+            return self.send(200, build_archive(self.server.data_dir, build['langs']),
+                             'application/zip')
+
+        if not url.path.startswith('/api/v2/'):
+            return self.send(404)
+        if not self.headers.get('Authorization', '').startswith('Bearer '):
+            return self.send(401, {'error': {'code': 401, 'message': 'Unauthorized'}})
+        route = url.path[len('/api/v2'):]
+
+        if route == '/storages' and method == 'POST':
+            with _LOCK:
+                storage_id = next(_IDS)
+                _STATE['storages'][storage_id] = body
+            return self.send(201, {'data': {'id': storage_id}})
+
+        m = re.fullmatch(r'/projects/(\d+)(/.*)?', route)
+        if m is None:
+            return self.send(404)
+        route = m.group(2) or ''
+        return self.handle_project(method, route, query, body)
+
+    def handle_project(self, method, route, query, body):
+        data_dir = self.server.data_dir
+        branch = self.server.branch
+
+        if route == '' and method == 'GET':
+            langs = sorted(os.listdir(os.path.join(data_dir, 'translations')))
+            return self.send(200, {'data': {
+                'id': 1,
+                'targetLanguageIds': langs,
+                'targetLanguages': [{'id': l, 'androidCode': l} for l in langs]}})
+
+        if route == '/branches' and method == 'GET':
+            branches = [{'data': {'id': 1, 'name': branch}}]
+            if query.get('name') not in (None, branch):
+                branches = []
+            return self.send(200, {'data': branches})
+
+        files = sorted(list_files(os.path.join(data_dir, 'sources')))
+        if route == '/files' and method == 'GET':
+            offset = int(query.get('offset', 0))
+            limit = int(query.get('limit', 25))
+            page = [{'data': {'id': i + 1, 'path': f'/{branch}/{f}'}}
+                    for i, f in enumerate(files)][offset:offset + limit]
+            return self.send(200, {'data': page})
+
+        m = re.fullmatch(r'/files/(\d+)', route)
+        if m and method == 'PUT':
+            storage_id = json.loads(body)['storageId']
+            with _LOCK:
+                _STATE['uploads'][int(m.group(1))] = _STATE['storages'].pop(storage_id)
+            return self.send(200, {'data': {'id': int(m.group(1))}})
+
+        m = re.fullmatch(r'/translations/builds/files/(\d+)', route)
+        if m and method == 'POST':
+            file_id = int(m.group(1))
+            lang = json.loads(body)['targetLanguageId']
+            if not 0 < file_id <= len(files):
+                return self.send(404)
+            export = find_export(data_dir, self.server.config, files[file_id - 1], lang)
+            if export is None:
+                return self.send(404)
+            with open(os.path.join(data_dir, 'translations', lang, export), 'rb') as fh:
+                etag = hashlib.sha1(fh.read()).hexdigest()
+            if self.headers.get('If-None-Match') == etag:
+                return self.send(304)
+            host = self.headers.get('Host')
+            return self.send(200, {'data': {'url': f'http://{host}/exports/{lang}/{export}',
+                                            'expireIn': '2099-01-01T00:00:00+00:00',
+                                            'etag': etag}})
+
+        if route == '/translations/builds' and method == 'POST':
+            request = json.loads(body)
+            with _LOCK:
+                build_id = next(_IDS)
+                _STATE['builds'][build_id] = {
+                    'langs': request.get('targetLanguageIds') or [],
+                    'ready': time.time() + self.server.build_delay,
+                }
+            return self.send(201, {'data': {'id': build_id, 'status': 'inProgress'}})
+
+        m = re.fullmatch(r'/translations/builds/(\d+)(/download)?', route)
+        if m and method == 'GET':
+            build_id = int(m.group(1))
+            build = _STATE['builds'].get(build_id)
+            if build is None:
+                return self.send(404)
+            finished = time.time() >= build['ready']
+            if m.group(2) is None:
+                status = 'finished' if finished else 'inProgress'
+                return self.send(200, {'data': {'id': build_id, 'status': status}})
+            if not finished:
+                return self.send(409)
+            host = self.headers.get('Host')
+            return self.send(200, {'data': {'url': f'http://{host}/archives/{build_id}.zip'}})
+
+        return self.send(404)
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def do_PUT(self):
+        self.handle_request('PUT')
+
+# ################################### MAIN ################################### #
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Local stand-in for the Crowdin API")
+    parser.add_argument('--data', required=True,
+                        help='Directory with translations/ and sources/')
+    parser.add_argument('--branch', required=True, help='Crowdin branch')
+    parser.add_argument('--config', help='Crowdin config of the branch')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--build-delay', type=float, default=0,
+                        help='Seconds a translation build takes')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='Do not log every request')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), CrowdinHandler)
+    server.data_dir = args.data
+    server.branch = args.branch
+    server.build_delay = args.build_delay
+    server.quiet = args.quiet
+    server.config = None
+    if args.config:
+        with open(args.config, 'r') as fh:
+            server.config = yaml.safe_load(fh)['files']
+    print(f'Serving on http://127.0.0.1:{server.server_port}/api/v2', file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# fake_gerrit_ssh.py
+#
+# Stand-in for "ssh <host> gerrit ..." to test and measure the Gerrit parts
+# of crowdin_sync.py without a live server. Use it with:
+#
+#   export AICP_GERRIT_SSH=/path/to/tools/fake_gerrit_ssh.py
+#
+# Environment variables:
+#   FAKE_GERRIT_CHANGES    number of open changes "gerrit query" returns
+#   FAKE_GERRIT_LIMIT      maximum number of changes per query, further ones are
+#                          reported as moreChanges and need --start (default 500)
+#   FAKE_GERRIT_ROW_DELAY  seconds each change of a query takes to arrive
+#   FAKE_GERRIT_HANDSHAKE  seconds a connection without master takes to open
+#   FAKE_GERRIT_DELAY      seconds a "gerrit review" takes
+#   FAKE_GERRIT_FLAKY      fraction of connections failing with exit code 255
+#   FAKE_GERRIT_LOG        file every handled gerrit command is appended to;
+#                          changes submitted according to it are not open anymore
+#   FAKE_GERRIT_REMOTES    directory of bare repositories pushed to through
+#                          AICP_GERRIT_PUSH_URL=file://<dir>; their refs/for/*
+#                          are returned as open changes instead of made up ones
+#                          (unlike Gerrit, a plain repository only accepts new
+#                          patch sets on top of the previous one)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#   http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# ################################# IMPORTS ################################## #
+
+import json
+import os
+import random
+import shlex
+import subprocess
+import sys
+import time
+
+# ################################ FUNCTIONS ################################# #
+
+# ssh options taking an argument
+_SSH_ARG_OPTIONS = {'-p', '-o', '-O', '-i', '-l', '-F', '-S'}
+
+
+def parse_ssh_args(argv):
+    # Returns the ssh options as dict and the remote command
+    options = {'-o': []}
+    i = 0
+    while i < len(argv) and argv[i].startswith('-'):
+        opt = argv[i]
+        if opt in _SSH_ARG_OPTIONS:
+            if opt == '-o':
+                options['-o'].append(argv[i + 1])
+            else:
+                options[opt] = argv[i + 1]
+            i += 2
+        else:
+            options[opt] = True
+            i += 1
+    # Like ssh, join the command and let the remote side split it again
+    return options, shlex.split(' '.join(argv[i + 1:]))
+
+
+def get_control_path(options):
+    for o in options['-o']:
+        if o.startswith('ControlPath='):
+            return o[len('ControlPath='):]
+    return None
+
+
+def log(cmd):
+    log_file = os.getenv('FAKE_GERRIT_LOG')
+    if log_file:
+        with open(log_file, 'a') as fh:
+            fh.write(' '.join(cmd) + '\n')
+
+
+def get_pushed_changes(remotes):
+    # Every branch pushed for review to a bare repository below remotes
+    number = 1000
+    for dp, dn, file_names in sorted(os.walk(remotes)):
+        if 'HEAD' not in file_names or 'refs' not in dn:
+            continue
+        dn.clear()
+        refs = subprocess.run(['git', 'for-each-ref', '--format=%(objectname) %(refname)',
+                               'refs/for/'], cwd=dp, capture_output=True, text=True,
+                              check=True).stdout
+        for line in sorted(refs.splitlines()):
+            revision, ref = line.split(' ', 1)
+            branch = ref[len('refs/for/'):]
+            number += 1
+            yield {
+                'project': os.path.relpath(dp, remotes),
+                'branch': branch,
+                'topic': f'Translations-{branch}',
+                'url': f'https://gerrit.example.com/c/{number}',
+                'number': number,
+                'open': True,
+                'currentPatchSet': {'number': 1, 'revision': revision, 'ref': ref},
+            }
+
+
+def get_changes():
+    remotes = os.getenv('FAKE_GERRIT_REMOTES')
+    if remotes:
+        yield from get_pushed_changes(remotes)
+        return
+    count = int(os.getenv('FAKE_GERRIT_CHANGES', '3'))
+    for i in range(count):
+        yield {
+            'project': f'AICP/project_{i}',
+            'branch': 'master',
+            'topic': 'Translations-master',
+            'url': f'https://gerrit.example.com/c/{1000 + i}',
+            'number': 1000 + i,
+            'open': True,
+            'currentPatchSet': {'number': 1, 'revision': f'{i:040x}'},
+        }
+
+
+def get_submitted():
+    # Revisions submitted so far, as far as the log tells
+    log_file = os.getenv('FAKE_GERRIT_LOG')
+    if not log_file or not os.path.exists(log_file):
+        return set()
+    with open(log_file, 'r') as fh:
+        return {line.split()[-1] for line in fh
+                if line.startswith('gerrit review') and '--submit' in line.split()}
+
+
+def query(cmd):
+    # Like Gerrit, return at most a limited number of changes from --start on,
+    # one line at a time, and tell if there are more
+    start = 0
+    for opt in ('--start', '-S'):
+        if opt in cmd:
+            start = int(cmd[cmd.index(opt) + 1])
+    limit = int(os.getenv('FAKE_GERRIT_LIMIT', '500'))
+    submitted = get_submitted()
+    changes = [c for c in get_changes() if c['currentPatchSet']['revision'] not in submitted]
+    page = changes[start:start + limit]
+    for change in page:
+        time.sleep(float(os.getenv('FAKE_GERRIT_ROW_DELAY', '0')))
+        print(json.dumps(change), flush=True)
+    print(json.dumps({'type': 'stats', 'rowCount': len(page),
+                      'moreChanges': start + limit < len(changes)}))
+    return 0
+
+
+def review(cmd):
+    time.sleep(float(os.getenv('FAKE_GERRIT_DELAY', '0')))
+    return 0
+
+# ################################### MAIN ################################### #
+
+
+def main():
+    options, cmd = parse_ssh_args(sys.argv[1:])
+    control_path = get_control_path(options)
+
+    # Master connection handling
+    if '-O' in options:
+        if control_path is not None and os.path.exists(control_path):
+            os.remove(control_path)
+        return 0
+    if '-N' in options:
+        if control_path is not None:
+            time.sleep(float(os.getenv('FAKE_GERRIT_HANDSHAKE', '0')))
+            open(control_path, 'w').close()
+        return 0
+
+    # Only connections without a running master pay for the handshake
+    if control_path is None or not os.path.exists(control_path):
+        time.sleep(float(os.getenv('FAKE_GERRIT_HANDSHAKE', '0')))
+    if random.random() < float(os.getenv('FAKE_GERRIT_FLAKY', '0')):
+        print('ssh: connect to host: Connection reset', file=sys.stderr)
+        return 255
+
+    log(cmd)
+    if cmd[:2] == ['gerrit', 'query']:
+        return query(cmd)
+    if cmd[:2] == ['gerrit', 'review']:
+        return review(cmd)
+    print(f'fatal: unknown command {" ".join(cmd)}', file=sys.stderr)
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())